@@ -43,30 +43,135 @@ def get_parser_common(parser: configargparse.ArgumentParser, config_name: str):
         "--data_dir", type=str, help="dir to store generated layout data"
     )
 
-    parser.add("--fem_degree", type=int, help="fem degree in fenics")
+    parser.add("--fem_degree", type=int, default=1, help="fem degree in fenics")
     parser.add("--u_D", type=int, help="value on Dirichlet boundary")
     parser.add("--nx", type=int, help="number of grid in x direction")
+    parser.add(
+        "--linear_solver",
+        type=str,
+        choices=["lu", "cg"],
+        default="lu",
+        help="lu (direct) or cg (preconditioned conjugate gradient, less memory on large meshes)",
+    )
+    parser.add(
+        "--preconditioner",
+        type=str,
+        default="amg",
+        help="preconditioner of cg: amg, hypre_amg, petsc_amg, ilu, jacobi, ...",
+    )
+    parser.add("--rtol", type=float, default=1e-10, help="relative tolerance of cg and multigrid")
+    parser.add("--atol", type=float, default=1e-12, help="absolute tolerance of cg and multigrid")
+    parser.add("--max_iter", type=int, default=1000, help="maximum iterations of cg and multigrid")
+    parser.add(
+        "--warm_start",
+        action="store_true",
+        help="cg starts from the previous solution (fewer iterations, results depend on sample order)",
+    )
+    parser.add(
+        "--mesh",
+        type=str,
+        choices=["uniform", "coarse", "adaptive"],
+        default="uniform",
+        help="fenics mesh, coarse solves on a mesh_base mesh (with fem_degree 2 or 3), "
+        "adaptive refines around components and heat sinks (2d)",
+    )
+    parser.add("--mesh_base", type=int, default=50, help="cells per direction of the coarse or adaptive base mesh")
+    parser.add("--mesh_levels", type=int, default=2, help="refinement levels of the adaptive mesh")
 
     parser.add("--sample_n", type=int, help="number of samples")
+    parser.add(
+        "--start", type=int, default=0, help="index of the first sample to generate"
+    )
+    parser.add(
+        "--stop",
+        type=int,
+        default=None,
+        help="generate samples with index < stop (default: sample_n)",
+    )
+    parser.add(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="skip samples that are already completely written in data_dir",
+    )
+    parser.add(
+        "--distributed",
+        action="store_true",
+        default=False,
+        help="share the sample range with other hosts through lease files in data_dir",
+    )
+    parser.add(
+        "--lease_block",
+        type=int,
+        default=64,
+        help="samples per lease in distributed mode",
+    )
+    parser.add(
+        "--lease_timeout",
+        type=float,
+        default=60.0,
+        help="seconds without heartbeat before a lease is reclaimed",
+    )
     parser.add(
         "--seed",
         type=int,
         default=np.random.randint(2 ** 32),
-        help="seed in np.random module",
+        help="seed of the layout, monitoring points and every sample",
     )
     parser.add(
-        "--file_format", type=str, choices=["mat"], help="dataset file format"
+        "--file_format", type=str, choices=["mat", "hdf5", "lazy", "npy-shards"], help="dataset file format"
+    )
+    parser.add(
+        "--sparse_obs",
+        action="store_true",
+        default=False,
+        help="store u_obs as the values at the monitoring points, indices in {prefix}.obs.npz",
+    )
+    parser.add("--shard_size", type=int, default=256, help="samples per shard (npy-shards)")
+    parser.add(
+        "--compression",
+        type=str,
+        choices=["none", "gzip", "lzf"],
+        default="none",
+        help="compression of dataset files: gzip (mat, hdf5, lazy) or lzf (hdf5), npy-shards are not compressed",
+    )
+    parser.add(
+        "--dtype",
+        type=str,
+        choices=["float64", "float32", "float16"],
+        default="float64",
+        help="storage precision of u, F, u_obs and coordinates (float16 steps are 0.25 K at 300 K, not for mat)",
     )
     parser.add("--prefix", type=str, help="prefix of file")
+    parser.add(
+        "--write_queue",
+        type=int,
+        default=64,
+        help="samples queued for the background writer (0: workers write directly)",
+    )
     parser.add(
         "--method",
         type=str,
-        choices=["fenics"],
-        help="method to solve the equation",
+        choices=["fenics", "superposition", "fd", "spectral", "multigrid"],
+        help="method to solve the equation (fd: finite difference, spectral / multigrid: "
+        "fd solved with fast sine/cosine transforms / geometric multigrid; all without fenics)",
+    )
+    parser.add(
+        "--mg_cycle",
+        type=str,
+        choices=["V", "F"],
+        default="V",
+        help="multigrid cycle (tolerances from rtol, atol, max_iter)",
     )
     parser.add(
         "--worker", type=int, default=os.cpu_count(), help="number of workers"
     )
+    parser.add(
+        "--chunksize",
+        type=int,
+        default=0,
+        help="samples dispatched to a worker at a time (0: auto)",
+    )
     parser.add("--ndim", type=int, choices=[2, 3], help="dimension")
     parser.add(
         "--vtk", action="store_true", default=False, help="output vtk file"
@@ -106,6 +211,13 @@ def get_parser_continuous_power(
         type=yaml.safe_load,
         help="power of each unit",
     )
+    parser.add(
+        "--power_sampling",
+        type=str,
+        choices=["random", "sobol", "halton", "lhs"],
+        default="random",
+        help="joint sampling of the powers of all units",
+    )
     parser.add(
         "--power_distribution",
         action="append",
@@ -113,6 +225,13 @@ def get_parser_continuous_power(
         help="power distribution of each unit",
     )
     parser.add("--gaussian_param", type=float, help="parameter in gaussian power distribution.")
+    parser.add(
+        "--rotation",
+        type=str,
+        choices=['nearest', 'area'],
+        default='nearest',
+        help="rasterization of rotated units: nearest or area",
+    )
     parser.add(
         "--geometry",
         action="append",
@@ -152,3 +271,25 @@ def get_parser_continuous_power(
     )
 
     return parser
+
+
+def load_options(config=None, **overrides):
+    """按 cli 的方式由配置文件与参数字典构造生成参数
+
+    Args:
+        config (str or dict): 配置文件路径 (默认 default_c_power.yml), 或参数字典
+        overrides: 覆盖配置文件中的参数, 如 nx=101, method="fd"
+    """
+    if isinstance(config, dict):
+        config, overrides = None, dict(config, **overrides)
+    parser = get_parser_continuous_power(configargparse.ArgumentParser())
+    options, _ = parser.parse_known_args([] if config is None else ["--config", str(config)])
+    for key, value in overrides.items():
+        if not hasattr(options, key):
+            raise KeyError(f"Unknown option {key}!")
+        setattr(options, key, value)
+    # cli 中 nx 为节点数，fenics求解过程中为单元数
+    options.nx -= 1
+    if options.bcs is None:
+        options.bcs = []
+    return options
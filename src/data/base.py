@@ -38,6 +38,7 @@ class Components:
         special=False,
         gaussian_param=1,
         rad=True,
+        rotation="nearest",
     ):
         assert (
             len(size) == len(intensity) == len(angle) == len(geometry) == len(power_distribution) == len(position)
@@ -91,11 +92,18 @@ class Components:
         #self.com2matrix()
 
         self.gaussian_param = gaussian_param
+        # 旋转组件的栅格化方式: nearest, area
+        self.rotation = rotation
 
         # 特殊样本
         self.special = special
         self.special_num = special_num
 
+        # 单位功率热源矩阵及覆盖掩码缓存 (见 FMatrix.unit2matrix)
+        self.unit_comgrid = None
+        self.unit_overlap = None
+        self.overlaping = None
+
     @property
     def real_area(self):
         """组件实际面积 real_x*real_y"""
@@ -7,33 +7,123 @@ Desc      :   Data processing.
 # Author  :   Zhiqiang Gong
 # Contact :   gongzhiqiang13@nudt.edu.cn
 
+import os
+import json
+import time
+import socket
 from pathlib import Path
 import numpy as np
 import scipy.io as sio
+import h5py
 
 
 def save(
     options, i, U, xs, ys, F, U_obs, monitoring, zs=None
 ):
     """存储数据"""
+    save_batch(options, [(i, U, F, U_obs)], xs, ys, monitoring, zs=zs)
+
+
+def save_batch(options, samples, xs, ys, monitoring, zs=None):
+    """存储一批数据
+
+    Args:
+        samples (list): [(i, U, F, U_obs), ...]
+    """
     data_dir = Path(options.data_dir)
-    file_name = f"{options.prefix}{i}"
-    path = data_dir / file_name
+    samples, xs, ys, monitoring, zs = cast_samples(options, samples, xs, ys, monitoring, zs=zs)
     if options.file_format == "mat":
-        path = path.with_suffix(".mat")
-        save_mat(
-            path,
-            U,
+        for i, U, F, U_obs in samples:
+            path = (data_dir / f"{options.prefix}{i}").with_suffix(".mat")
+            save_mat(
+                path,
+                U,
+                xs,
+                ys,
+                F,
+                U_obs,
+                # 稀疏测点的位置只在 {prefix}.obs.npz 中存储一次
+                None if options.sparse_obs else monitoring,
+                zs=zs,
+                compression=options.compression not in [None, "none"],
+            )
+    elif options.file_format == "npy-shards":
+        save_shards(options, samples, xs, ys, monitoring, zs=zs)
+    elif options.file_format == "hdf5":
+        save_hdf5(
+            data_dir / f"{options.prefix}.h5",
+            samples,
             xs,
             ys,
-            F,
-            U_obs,
             monitoring,
             zs=zs,
+            compression=options.compression,
+            config=options,
+        )
+    record_done(options, [sample[0] for sample in samples])
+
+
+def cast_samples(options, samples, xs, ys, monitoring, zs=None):
+    """场转换为存储精度 dtype, 坐标保持 float64, 测点掩码存为 uint8"""
+    dtype = np.dtype(options.dtype)
+    samples = [
+        (i, to_dtype(U, dtype, "u"), to_dtype(F, dtype, "F"), to_dtype(U_obs, dtype, "u_obs"))
+        for i, U, F, U_obs in samples
+    ]
+    monitoring = np.asarray(monitoring).astype(np.uint8, copy=False)
+    return samples, coordinates(xs), coordinates(ys), monitoring, coordinates(zs)
+
+
+def to_dtype(array, dtype, name="array"):
+    """转换为存储精度, 溢出 (如 float16 最大 65504) 或出现非有限值时报错"""
+    array = np.asarray(array)
+    with np.errstate(over="ignore"):
+        result = array.astype(dtype, copy=False)
+    if result.dtype.kind == "f" and not np.isfinite(result).all():
+        if not np.isfinite(array).all():
+            raise ValueError(f"{name} contains non-finite values!")
+        raise ValueError(
+            f"{name} overflows {result.dtype.name} (max |{name}| = {np.abs(array).max():.6g}), use a wider dtype!"
         )
+    return result
+
+
+def coordinates(array):
+    """网格坐标始终以 float64 存储, 细网格上低精度会使相邻坐标重合"""
+    return None if array is None else np.asarray(array, dtype=np.float64)
+
+
+def check_storage(options):
+    """检查存储格式、精度与压缩方式能否组合"""
+    compression = options.compression or "none"
+    if options.file_format == "mat":
+        # savemat 会将 float16 转为 float64
+        if options.dtype == "float16":
+            raise ValueError("mat files do not support float16, use hdf5 or npy-shards!")
+        if compression not in ["none", "gzip"]:
+            raise ValueError(f"mat files do not support {compression} compression (gzip)!")
+    elif options.file_format == "lazy" and compression not in ["none", "gzip"]:
+        raise ValueError(f"lazy format does not support {compression} compression (gzip)!")
+    elif options.file_format == "npy-shards" and compression != "none":
+        raise ValueError("npy-shards are memory-mapped and cannot be compressed!")
+    elif options.file_format == "hdf5":
+        # hdf5 文件只能由一个进程写入
+        if options.write_queue <= 0:
+            raise ValueError("hdf5 is written by the background writer, set write_queue > 0!")
+        if options.distributed:
+            raise ValueError("hdf5 cannot be written by several hosts, use npy-shards or mat with --distributed!")
+
 
+def dataset_bytes(options):
+    """数据目录中属于本数据集的文件的总字节数"""
+    total = 0
+    for path in Path(options.data_dir).glob(f"{options.prefix}*"):
+        if path.is_file() and path.suffix not in [".journal", ".lock", ".tmp"]:
+            total += path.stat().st_size
+    return total
 
-def save_mat(path, U, xs, ys, F, U_obs, monitoring, zs=None):
+
+def save_mat(path, U, xs, ys, F, U_obs, monitoring, zs=None, compression=False):
     # 组件位置从 1 开始
     zs = zs if zs is not None else []
     data = {
@@ -43,12 +133,492 @@ def save_mat(path, U, xs, ys, F, U_obs, monitoring, zs=None):
         "zs": zs,
         "F": F,
         "u_obs": U_obs,
-        "u_pos": monitoring
     }
-    sio.savemat(path, data)
+    if monitoring is not None:
+        data["u_pos"] = monitoring
+    # 先写临时文件再改名, 中断时不会留下写了一半的 mat 文件
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        sio.savemat(f, data, do_compression=compression)
+    os.replace(tmp_path, path)
 
 
 def load_mat(path):
     path = Path(path)
     assert path.suffix == ".mat"
-    return sio.loadmat(path)
\ No newline at end of file
+    return sio.loadmat(path)
+
+
+class Observations:
+    """稀疏存储的测点
+
+    With ``sparse_obs`` every sample stores only the ``(k,)`` temperatures
+    at the monitoring points and the dataset stores the ``(k, ndim)`` grid
+    indices once, in ``{prefix}.obs.npz``. ``dense`` rebuilds the
+    ``u_obs`` grid of the dense formats, exactly ``U * u_pos``.
+
+    Args:
+        index (ndarray): 测点的网格索引, shape (k, ndim)
+        shape (tuple): 温度场的 shape
+    """
+
+    def __init__(self, index, shape):
+        self.index = np.asarray(index, dtype=np.int64)
+        self.shape = tuple(int(n) for n in shape)
+        self._index = tuple(self.index.T)
+
+    @classmethod
+    def from_mask(cls, mask, shape):
+        """由测点掩码构造, 2-D 掩码在 3-D 温度场中沿 z 方向延伸"""
+        return cls(np.argwhere(np.broadcast_to(mask, shape) != 0), shape)
+
+    def __len__(self):
+        return self.index.shape[0]
+
+    @property
+    def mask(self):
+        """稠密的测点掩码, 即 u_pos"""
+        mask = np.zeros(self.shape)
+        mask[self._index] = 1
+        return mask
+
+    def values(self, U):
+        """温度场在测点上的值, U 的 shape 为 (..., *shape)"""
+        U = np.asarray(U)
+        return U[(Ellipsis,) + self._index]
+
+    def dense(self, values):
+        """由测点值还原 u_obs, values 的 shape 为 (..., k)"""
+        values = np.asarray(values)
+        U_obs = np.zeros(values.shape[:-1] + self.shape, dtype=values.dtype)
+        U_obs[(Ellipsis,) + self._index] = values
+        return U_obs
+
+    def densify(self, data):
+        """将样本中的稀疏测点值还原为稠密的 u_obs 与 u_pos"""
+        data = dict(data)
+        # loadmat 将 (k,) 读为 (1, k)
+        batch_shape = np.shape(data["u"])[:-len(self.shape)]
+        data["u_obs"] = self.dense(np.reshape(data["u_obs"], batch_shape + (-1,)))
+        data["u_pos"] = self.mask
+        return data
+
+
+def obs_path(data_dir, prefix):
+    return Path(data_dir) / f"{prefix}.obs.npz"
+
+
+def save_observations(options, observations):
+    """写入稀疏测点的网格索引"""
+
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            np.savez(f, index=observations.index, shape=np.array(observations.shape))
+
+    link_new(obs_path(options.data_dir, options.prefix), write)
+
+
+def load_observations(data_dir, prefix):
+    """读取稀疏测点, 数据集未使用 sparse_obs 时返回 None"""
+    path = obs_path(data_dir, prefix)
+    if not path.exists():
+        return None
+    with np.load(path) as f:
+        return Observations(f["index"], f["shape"])
+
+
+# 写进程中保持打开的 hdf5 文件 {path: File}
+_hdf5_files = {}
+
+
+def save_hdf5(path, samples, xs, ys, monitoring, zs=None, compression=None, config=None):
+    """将样本写入 hdf5 文件
+
+    Every field is a chunked dataset indexed by sample, one chunk per
+    sample. The coordinates, the monitoring mask and the config are stored
+    once. The file is opened once per process, the datasets grow by resize
+    and every batch is flushed before the samples are marked ``written``
+    and journaled, so a killed run loses at most the batch in flight.
+
+    HDF5 has no concurrent writers: ``check_storage`` only allows hdf5 with
+    the single background writer process and without ``--distributed``.
+    HDF5's own file lock makes a second run on the same file fail instead
+    of corrupting it, but that lock is not reliable on NFS.
+
+    Args:
+        path (Path): hdf5 文件路径
+        samples (list): [(i, U, F, U_obs), ...]
+        compression (str): None, "none", "gzip" or "lzf"
+        config (Namespace): 生成参数, 首次写入时保存
+    """
+    compression = None if compression in [None, "none"] else compression
+    if path not in _hdf5_files:
+        _hdf5_files[path] = h5py.File(path, "a")
+    f = _hdf5_files[path]
+    if "u_pos" not in f:
+        f.create_dataset("xs", data=xs)
+        f.create_dataset("ys", data=ys)
+        if zs is not None:
+            f.create_dataset("zs", data=zs)
+        f.create_dataset("u_pos", data=monitoring)
+        if config is not None:
+            f.attrs["config"] = json.dumps(vars(config), default=str)
+    n = max(i for i, *_ in samples) + 1
+    for name, k in [("u", 1), ("F", 2), ("u_obs", 3)]:
+        shape = np.shape(samples[0][k])
+        if name not in f:
+            f.create_dataset(
+                name,
+                shape=(n,) + shape,
+                maxshape=(None,) + shape,
+                chunks=(1,) + shape,
+                dtype=np.asarray(samples[0][k]).dtype,
+                compression=compression,
+            )
+    if "written" not in f:
+        f.create_dataset("written", shape=(n,), maxshape=(None,), dtype=bool, chunks=True)
+    for name in ["u", "F", "u_obs", "written"]:
+        if f[name].shape[0] < n:
+            f[name].resize(n, axis=0)
+    for i, U, F, U_obs in samples:
+        f["u"][i] = U
+        f["F"][i] = F
+        f["u_obs"][i] = U_obs
+    f.flush()
+    for i, *_ in samples:
+        f["written"][i] = True
+    f.flush()
+
+
+def close_hdf5():
+    """关闭本进程打开的 hdf5 文件"""
+    while _hdf5_files:
+        _, f = _hdf5_files.popitem()
+        f.close()
+
+
+def load_hdf5(path, i):
+    """读取 hdf5 文件中的第 i 个样本, 格式与 load_mat 一致"""
+    with h5py.File(path, "r") as f:
+        assert i < f["written"].shape[0] and f["written"][i], f"Sample {i} has not been written"
+        data = {
+            "u": f["u"][i],
+            "xs": f["xs"][()],
+            "ys": f["ys"][()],
+            "zs": f["zs"][()] if "zs" in f else [],
+            "F": f["F"][i],
+            "u_obs": f["u_obs"][i],
+            "u_pos": f["u_pos"][()],
+        }
+    return data
+
+
+def lazy_paths(data_dir, prefix):
+    """lazy 格式的叠加基文件与功率表文件"""
+    data_dir = Path(data_dir)
+    return data_dir / f"{prefix}.basis.npz", data_dir / f"{prefix}.weights.npy"
+
+
+def save_basis(options, basis, monitoring):
+    """lazy 格式: 写入叠加基与空的功率表
+
+    The basis holds ``U_bc`` and the unit fields ``U``, ``F`` of every
+    component, in the storage ``dtype``. The weights table is a
+    ``(sample_n, number)`` float64 npy file filled with NaN, one row per
+    sample is written by ``save_weights``. Both files are written under a
+    temporary name and linked into place, so the hosts of a distributed run
+    create them exactly once.
+    """
+    basis_path, weights_path = lazy_paths(options.data_dir, options.prefix)
+    dtype = np.dtype(options.dtype)
+    data = dict(
+        U_bc=to_dtype(basis.U_bc, dtype, "U_bc"),
+        U=to_dtype(basis.U, dtype, "U"),
+        F=to_dtype(basis.F, dtype, "F"),
+        xs=coordinates(basis.xs),
+        ys=coordinates(basis.ys),
+        u_pos=np.asarray(monitoring).astype(np.uint8),
+        config=json.dumps(vars(options), default=str),
+    )
+    if basis.zs is not None:
+        data["zs"] = coordinates(basis.zs)
+    savez = np.savez if options.compression in [None, "none"] else np.savez_compressed
+
+    def write_basis(tmp_path):
+        with open(tmp_path, "wb") as f:
+            savez(f, **data)
+
+    shape = (options.sample_n, basis.U.shape[0])
+    link_new(basis_path, write_basis)
+    create_npy(weights_path, shape, np.float64, fill=np.nan)
+    existing, _, _ = npy_header(weights_path)
+    if existing != shape:
+        raise ValueError(f"{weights_path} has shape {existing}, expected {shape}!")
+
+
+def link_new(path, write):
+    """写临时文件后 link 到 path, path 已存在时保留原文件"""
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    write(tmp_path)
+    try:
+        os.link(tmp_path, path)
+    except FileExistsError:
+        pass
+    finally:
+        tmp_path.unlink()
+
+
+def create_npy(path, shape, dtype, fill=None):
+    """新建 npy 文件, 已存在时保留原文件; 不填充时为稀疏文件 (全 0)"""
+
+    def write(tmp_path):
+        array = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=shape)
+        if fill is not None:
+            array[:] = fill
+        array.flush()
+        del array
+
+    link_new(path, write)
+
+
+def npy_header(path):
+    """npy 文件的 shape, dtype 与数据起始位置"""
+    with open(path, "rb") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        assert not fortran_order, f"{path} is not C ordered"
+        return shape, dtype, f.tell()
+
+
+# 每个进程打开一次的 npy 文件 {path: (fd, shape, dtype, offset)}
+_npy_files = {}
+
+
+def write_npy_rows(path, rows):
+    """按行原地写入 npy 文件
+
+    Rows are written with pwrite, so workers and hosts can fill different
+    rows of the same file without locking.
+
+    Args:
+        rows (list): [(行号, 数组), ...]
+    """
+    if path not in _npy_files:
+        shape, dtype, offset = npy_header(path)
+        _npy_files[path] = (os.open(path, os.O_WRONLY), shape, dtype, offset)
+    fd, shape, dtype, offset = _npy_files[path]
+    for k, row in rows:
+        row = np.ascontiguousarray(row, dtype=dtype)
+        assert row.shape == shape[1:] and k < shape[0], f"Wrong row {k} of {path}"
+        os.pwrite(fd, row.tobytes(), offset + k * row.nbytes)
+
+
+def save_weights(options, samples):
+    """lazy 格式: 按行写入组件有效功率
+
+    Args:
+        samples (list): [(i, weights), ...]
+    """
+    _, path = lazy_paths(options.data_dir, options.prefix)
+    write_npy_rows(path, samples)
+    record_done(options, [sample[0] for sample in samples])
+
+
+# npy-shards 格式中按样本分片存储的变量
+SHARD_FIELDS = ["u", "F", "u_obs"]
+
+
+def shards_paths(data_dir, prefix):
+    """npy-shards 格式的索引文件与公共变量文件"""
+    data_dir = Path(data_dir)
+    return data_dir / f"{prefix}.shards.json", data_dir / f"{prefix}.shared.npz"
+
+
+def shard_path(data_dir, prefix, name, k):
+    return Path(data_dir) / f"{prefix}.{name}.{k:05d}.npy"
+
+
+def save_shards(options, samples, xs, ys, monitoring, zs=None):
+    """npy-shards 格式: 每 shard_size 个样本的 u, F, u_obs 各存为一个 npy 文件
+
+    Sample ``i`` is row ``i % shard_size`` of shard ``i // shard_size``.
+    Shards are created as sparse files on first use and rows are written
+    in place. The coordinates and the monitoring mask go to
+    ``{prefix}.shared.npz`` and the shapes to the JSON index
+    ``{prefix}.shards.json``, which is written last.
+    """
+    index_path, shared_path = shards_paths(options.data_dir, options.prefix)
+    if not index_path.exists():
+        shared = dict(xs=xs, ys=ys, u_pos=monitoring)
+        if zs is not None:
+            shared["zs"] = zs
+
+        def write_shared(tmp_path):
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **shared)
+
+        index = dict(
+            count=options.sample_n,
+            shard_size=options.shard_size,
+            seed=options.seed,
+            fields={
+                name: dict(shape=list(np.shape(samples[0][k + 1])), dtype=np.dtype(options.dtype).name)
+                for k, name in enumerate(SHARD_FIELDS)
+            },
+        )
+
+        def write_index(tmp_path):
+            with open(tmp_path, "w") as f:
+                json.dump(index, f, indent=2)
+
+        link_new(shared_path, write_shared)
+        link_new(index_path, write_index)
+    index = load_shards_index(index_path)
+    if index["shard_size"] != options.shard_size or index["count"] != options.sample_n:
+        raise ValueError(f"{index_path} belongs to a run with other shard_size or sample_n!")
+
+    size, count = index["shard_size"], index["count"]
+    rows = {}
+    for i, *fields in samples:
+        assert i < count, f"Sample {i} is beyond sample_n"
+        k, row = divmod(i, size)
+        for name, value in zip(SHARD_FIELDS, fields):
+            rows.setdefault((name, k), []).append((row, value))
+    for (name, k), values in rows.items():
+        path = shard_path(options.data_dir, options.prefix, name, k)
+        if path not in _npy_files and not path.exists():
+            field = index["fields"][name]
+            shape = (min(size, count - k * size),) + tuple(field["shape"])
+            create_npy(path, shape, field["dtype"])
+        write_npy_rows(path, values)
+
+
+_shards_index = {}
+
+
+def load_shards_index(path):
+    if path not in _shards_index:
+        with open(path) as f:
+            _shards_index[path] = json.load(f)
+    return _shards_index[path]
+
+
+def journal_path(options):
+    """本进程写入的完成日志, 分布式运行时每台机器一个"""
+    if getattr(options, "distributed", False):
+        return Path(options.data_dir) / f"{options.prefix}.{socket.gethostname()}.journal"
+    return Path(options.data_dir) / f"{options.prefix}.journal"
+
+
+def journal_paths(data_dir, prefix):
+    """数据集的全部完成日志"""
+    data_dir = Path(data_dir)
+    return sorted(data_dir.glob(f"{prefix}.journal")) + sorted(data_dir.glob(f"{prefix}.*.journal"))
+
+
+def record_done(options, indices):
+    """在完成日志中追加已写完的样本序号
+
+    Each line is ``seed index``. The file is opened with O_APPEND and every
+    batch is one small write, so the processes of one host can share the
+    journal. O_APPEND is not atomic across NFS clients, so with
+    ``--distributed`` every host appends to its own ``{prefix}.{host}.journal``
+    and readers take the union of all journals.
+    """
+    lines = "".join(f"{options.seed} {i}\n" for i in indices)
+    fd = os.open(journal_path(options), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, lines.encode())
+    finally:
+        os.close(fd)
+
+
+def journal_indices(options):
+    """完成日志中当前 seed 的样本序号, 没有日志时返回 None"""
+    paths = journal_paths(options.data_dir, options.prefix)
+    if not paths:
+        return None
+    return read_journals(paths, options.seed)
+
+
+def read_journals(paths, seed):
+    """完成日志中 seed 的样本序号"""
+    done = set()
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                fields = line.split()
+                # 最后一行可能因中断而不完整
+                if len(fields) == 2 and fields[0] == str(seed) and fields[1].isdigit():
+                    done.add(int(fields[1]))
+    return done
+
+
+def remove_tmp(options, min_age=0.0):
+    """删除中断的进程留下的临时文件
+
+    Covers the ``{prefix}{i}.mat.tmp`` files of ``save_mat`` and the
+    ``.{name}.{pid}.tmp`` files of ``link_new``. Only files not modified for
+    ``min_age`` seconds are removed, so hosts sharing the data dir keep the
+    files they are writing.
+    """
+    data_dir = Path(options.data_dir)
+    now = time.time()
+    for path in list(data_dir.glob(f"{options.prefix}*.tmp")) + list(data_dir.glob(f".{options.prefix}*.tmp")):
+        try:
+            if now - path.stat().st_mtime >= min_age:
+                path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def completed_indices(options, indices):
+    """indices 中已经完整写出的样本
+
+    Samples are taken from the completion journal (entries of other seeds
+    are ignored) and checked against the files on disk. Without a journal
+    the data dir is scanned instead, except for npy-shards: unwritten rows
+    of a sparse shard read as zeros and cannot be told from written ones,
+    so there nothing counts as complete.
+    """
+    indices = set(indices)
+    journal = journal_indices(options)
+    done = indices if journal is None else journal & indices
+
+    data_dir = Path(options.data_dir)
+    if options.file_format == "mat":
+        names = {"u", "F", "u_obs"} if options.sparse_obs else {"u", "F", "u_obs", "u_pos"}
+        return {i for i in done if is_valid_mat(data_dir / f"{options.prefix}{i}.mat", names)}
+    elif options.file_format == "npy-shards":
+        # 行在写入完成日志之前写入, 日志中的样本只需检查分片文件存在
+        if journal is None:
+            return set()
+        size = options.shard_size
+        return {i for i in done if shard_path(data_dir, options.prefix, "u", i // size).exists()}
+    elif options.file_format == "lazy":
+        _, path = lazy_paths(data_dir, options.prefix)
+        if not path.exists():
+            return set()
+        written = ~np.isnan(np.load(path, mmap_mode="r")).any(axis=1)
+        return {i for i in done if i < written.size and written[i]}
+    elif options.file_format == "hdf5":
+        path = data_dir / f"{options.prefix}.h5"
+        if not path.exists():
+            return set()
+        with h5py.File(path, "r") as f:
+            written = f["written"][()] if "written" in f else np.zeros(0, dtype=bool)
+        return {i for i in done if i < written.size and written[i]}
+    return set()
+
+
+def is_valid_mat(path, names=("u", "F", "u_obs", "u_pos")):
+    """mat 文件存在且包含全部变量"""
+    try:
+        written = {name for name, _, _ in sio.whosmat(path)}
+    except Exception:
+        return False
+    return set(names) <= written
@@ -0,0 +1,105 @@
+# -*- encoding: utf-8 -*-
+"""
+Desc      :   Reader of the lazy (parametric) dataset format.
+"""
+# File    :   lazy.py
+
+from collections import OrderedDict
+import numpy as np
+
+from src.data.data_processing import lazy_paths, load_observations
+
+
+class LazyDataset:
+    """lazy 格式数据集, 读取时由叠加基构造温度场
+
+    A lazy dataset stores the superposition basis once and one row of
+    component weights per sample. Reading sample ``i`` computes
+
+        u = U_bc + weights[i] @ U,  F = weights[i] @ F_unit,  u_obs = u * u_pos
+
+    the same linear combination as ``SuperpositionBasis``, so the fields
+    match a full solve up to floating point rounding. With ``sparse_obs``
+    ``u_obs`` holds only the values at the monitoring points. Recently built
+    samples are kept in an LRU cache.
+
+    Args:
+        data_dir (str): 数据目录
+        prefix (str): 文件前缀
+        cache_size (int): 缓存的样本数
+    """
+
+    def __init__(self, data_dir, prefix="Example", cache_size=256):
+        basis_path, weights_path = lazy_paths(data_dir, prefix)
+        with np.load(basis_path) as basis:
+            self.U_bc = basis["U_bc"]
+            U = basis["U"]
+            F = basis["F"]
+            self.xs = basis["xs"]
+            self.ys = basis["ys"]
+            self.zs = basis["zs"] if "zs" in basis else []
+            self.u_pos = basis["u_pos"]
+            self.config = str(basis["config"])
+        self.weights = np.load(weights_path, mmap_mode="r")
+        self.observations = load_observations(data_dir, prefix)
+        # 展平后一批样本只需一次矩阵乘法
+        self._U_flat = U.reshape(U.shape[0], -1)
+        self._F_flat = F.reshape(F.shape[0], -1)
+        self._F_shape = F.shape[1:]
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return self.weights.shape[0]
+
+    @property
+    def written(self):
+        """已写入的样本, shape (n,)"""
+        return ~np.isnan(self.weights).any(axis=1)
+
+    def __getitem__(self, i):
+        """第 i 个样本, 格式与 load_mat 一致"""
+        batch = self.batch([i])
+        for name in ["u", "F", "u_obs"]:
+            batch[name] = batch[name][0]
+        return batch
+
+    def batch(self, indices):
+        """一批样本, u, F, u_obs 的 shape 为 (len(indices), ...)"""
+        indices = [int(i) for i in indices]
+        missing = sorted({i for i in indices if i not in self._cache})
+        if missing:
+            self._build(missing)
+        fields = []
+        for i in indices:
+            self._cache.move_to_end(i)
+            fields.append(self._cache[i])
+        u, F, u_obs = (np.stack(k) for k in zip(*fields))
+        # 本批次样本可能多于缓存大小, 读取后再淘汰
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return {
+            "u": u,
+            "xs": self.xs,
+            "ys": self.ys,
+            "zs": self.zs,
+            "F": F,
+            "u_obs": u_obs,
+            "u_pos": self.u_pos,
+        }
+
+    def _build(self, indices):
+        weights = np.asarray(self.weights[indices])
+        for i, row in zip(indices, weights):
+            assert i < len(self) and not np.isnan(row).any(), f"Sample {i} has not been written"
+        # 功率为 float64, 结果转回叠加基的存储精度
+        dtype = self.U_bc.dtype
+        u = (self.U_bc.ravel() + weights @ self._U_flat).astype(dtype, copy=False)
+        u = u.reshape((-1,) + self.U_bc.shape)
+        F = (weights @ self._F_flat).astype(dtype, copy=False).reshape((-1,) + self._F_shape)
+        if self.observations is None:
+            u_obs = u * self.u_pos
+        else:
+            u_obs = self.observations.values(u)
+        for k, i in enumerate(indices):
+            self._cache[i] = (u[k], F[k], u_obs[k])
@@ -0,0 +1,92 @@
+# -*- encoding: utf-8 -*-
+"""
+Desc      :   Memory-mapped reader of the npy-shards dataset format.
+"""
+# File    :   shards.py
+
+from pathlib import Path
+import numpy as np
+
+from src.data.data_processing import (
+    SHARD_FIELDS,
+    shards_paths,
+    shard_path,
+    load_shards_index,
+    load_observations,
+    journal_paths,
+    read_journals,
+)
+
+
+class ShardDataset:
+    """npy-shards 格式数据集
+
+    Shards are opened with ``np.load(mmap_mode="r")``, so samples and
+    batches within one shard are read-only views of the page cache: nothing
+    is parsed or copied until the data is used, and loader processes on
+    the same host share the cached pages. With ``sparse_obs`` ``u_obs`` holds
+    the values at the monitoring points, ``observations.densify`` rebuilds
+    the dense grids.
+
+    Args:
+        data_dir (str): 数据目录
+        prefix (str): 文件前缀
+    """
+
+    def __init__(self, data_dir, prefix="Example"):
+        self.data_dir = Path(data_dir)
+        self.prefix = prefix
+        index_path, shared_path = shards_paths(data_dir, prefix)
+        self.index = load_shards_index(index_path)
+        self.shard_size = self.index["shard_size"]
+        with np.load(shared_path) as shared:
+            self.xs = shared["xs"]
+            self.ys = shared["ys"]
+            self.zs = shared["zs"] if "zs" in shared else []
+            self.u_pos = shared["u_pos"]
+        self.observations = load_observations(data_dir, prefix)
+        self._shards = {}
+
+    def __len__(self):
+        return self.index["count"]
+
+    @property
+    def written(self):
+        """完成日志中已写入的样本, shape (n,)"""
+        written = np.zeros(len(self), dtype=bool)
+        done = read_journals(journal_paths(self.data_dir, self.prefix), self.index["seed"])
+        written[[i for i in done if i < len(self)]] = True
+        return written
+
+    def shard(self, name, k):
+        """第 k 个分片中变量 name 的 memmap"""
+        if (name, k) not in self._shards:
+            path = shard_path(self.data_dir, self.prefix, name, k)
+            self._shards[name, k] = np.load(path, mmap_mode="r")
+        return self._shards[name, k]
+
+    def __getitem__(self, i):
+        """第 i 个样本, 格式与 load_mat 一致, u, F, u_obs 为只读视图"""
+        if not 0 <= i < len(self):
+            raise IndexError(f"Sample {i} out of range")
+        k, row = divmod(i, self.shard_size)
+        data = {name: self.shard(name, k)[row] for name in SHARD_FIELDS}
+        data.update(xs=self.xs, ys=self.ys, zs=self.zs, u_pos=self.u_pos)
+        return data
+
+    def batch(self, start, stop):
+        """样本 [start, stop), 在同一分片内时为只读视图, 跨分片时复制拼接"""
+        if not 0 <= start < stop <= len(self):
+            raise IndexError(f"Samples [{start}, {stop}) out of range")
+        data = {}
+        for name in SHARD_FIELDS:
+            parts = []
+            i = start
+            while i < stop:
+                k, row = divmod(i, self.shard_size)
+                n = min(stop - i, self.shard_size - row)
+                parts.append(self.shard(name, k)[row:row + n])
+                i += n
+            data[name] = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        data.update(xs=self.xs, ys=self.ys, zs=self.zs, u_pos=self.u_pos)
+        return data
@@ -0,0 +1,165 @@
+# -*- encoding: utf-8 -*-
+"""
+Desc      :   Asynchronous dataset writer.
+"""
+# File    :   writer.py
+
+import queue
+import signal
+import traceback
+from multiprocessing import Event, Pipe, Process, Queue
+
+import src.data.data_processing as data_processing
+
+
+WRITE_BATCH = 16  # 每次最多合并写入的样本数
+PUT_TIMEOUT = 1.0  # 队列满时检查写进程状态的间隔 (s)
+GET_TIMEOUT = 0.5  # 队列空时检查停止信号的间隔 (s)
+
+
+class AsyncWriter:
+    """后台写数据进程
+
+    Workers put finished samples on a bounded queue and a dedicated process
+    writes them in batches, so solving overlaps with disk I/O and workers
+    only block (backpressure) when the queue is full. If writing fails, the
+    writer sets ``failed`` so blocked workers give up, sends the exception
+    back over a pipe and exits; ``check`` re-raises it in the main process.
+
+    ``close`` sets the ``stop`` event instead of sending a sentinel through
+    the queue: a worker killed by Ctrl-C can die holding the queue's write
+    lock, and nothing put after that would ever arrive. The writer writes
+    everything readable and exits once the event is set and the queue is
+    empty.
+
+    Args:
+        options (Namespace): 生成参数
+        maxsize (int): 队列长度
+    """
+
+    def __init__(self, options, maxsize=64, batch_size=WRITE_BATCH):
+        self.queue = Queue(maxsize)
+        self.failed = Event()
+        self.stop = Event()
+        self._errors, errors = Pipe(duplex=False)
+        self.process = Process(
+            target=write_loop, args=(self.queue, options, batch_size, errors, self.failed, self.stop)
+        )
+        self.process.start()
+        errors.close()
+        self.closed = False
+
+    def qsize(self):
+        """队列中等待写入的样本数"""
+        try:
+            return self.queue.qsize()
+        except NotImplementedError:  # macOS
+            return -1
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def check(self):
+        """写进程异常退出时在主进程中抛出其异常"""
+        if self.process.is_alive() or (self.closed and self.process.exitcode == 0):
+            return
+        if self._errors.poll():
+            error, text = self._errors.recv()
+            raise error from RuntimeError(f"in the writer process:\n{text}")
+        raise RuntimeError(f"Writer process exited with code {self.process.exitcode}")
+
+    def close(self, timeout=600.0):
+        """写完队列中所有样本后退出, 超过 timeout 秒时终止写进程
+
+        Call it after the workers have exited (or were terminated), so that
+        everything they sent is already in the queue.
+        """
+        self.stop.set()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.queue.cancel_join_thread()
+        self.queue.close()
+        self.closed = True
+
+
+class QueueSaver:
+    """工作进程中的 save, 与 data_processing.save 参数一致
+
+    The coordinates and the monitoring mask are the same for every sample,
+    so each worker sends them to the writer only once.
+    """
+
+    def __init__(self, queue, failed=None):
+        self.queue = queue
+        self.failed = failed
+        self.shared_sent = False
+
+    def save(self, options, i, U, xs, ys, F, U_obs, monitoring, zs=None):
+        if not self.shared_sent:
+            self.put(("shared", xs, ys, monitoring, zs))
+            self.shared_sent = True
+        self.put(("sample", i, U, F, U_obs))
+
+    def put(self, item):
+        """队列满时定期检查写进程, 写进程失败后不再阻塞"""
+        while True:
+            try:
+                self.queue.put(item, timeout=PUT_TIMEOUT)
+                return
+            except queue.Full:
+                if self.failed is not None and self.failed.is_set():
+                    raise RuntimeError("Writer process failed, see the main process")
+
+
+def write_loop(queue_in, options, batch_size=WRITE_BATCH, errors=None, failed=None, stop=None):
+    """写数据进程, 异常通过 errors 发回主进程"""
+    # Ctrl-C 由主进程处理, 保证队列中的样本全部写完
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        write_batches(queue_in, options, batch_size, stop)
+    except BaseException as e:
+        if failed is not None:
+            failed.set()
+        if errors is None:
+            raise
+        text = traceback.format_exc()
+        try:
+            errors.send((e, text))
+        except Exception:
+            # 异常无法序列化时只发回文本
+            errors.send((RuntimeError(str(e)), text))
+        raise SystemExit(1)
+    finally:
+        data_processing.close_hdf5()
+        if errors is not None:
+            errors.close()
+
+
+def write_batches(queue_in, options, batch_size=WRITE_BATCH, stop=None):
+    """等待一个样本, 再合并队列中已有的样本一起写入; stop 置位且队列为空时返回"""
+    shared = None
+    while True:
+        # 先读停止信号: 置位前发出的样本此时都已可读, 队列为空即可退出
+        stopping = stop is not None and stop.is_set()
+        try:
+            items = [queue_in.get(timeout=GET_TIMEOUT)]
+        except queue.Empty:
+            if stopping:
+                break
+            continue
+        while len(items) < batch_size:
+            try:
+                items.append(queue_in.get_nowait())
+            except queue.Empty:
+                break
+        samples = []
+        for item in items:
+            if item[0] == "shared":
+                shared = item[1:]
+            else:
+                samples.append(item[1:])
+        if samples:
+            xs, ys, monitoring, zs = shared
+            data_processing.save_batch(options, samples, xs, ys, monitoring, zs=zs)
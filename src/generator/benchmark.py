@@ -0,0 +1,260 @@
+# -*- encoding: utf-8 -*-
+"""
+Desc      :   Benchmark of the solver backends.
+"""
+# File    :   benchmark.py
+
+import time
+import resource
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import configargparse
+
+from src.config.configarg import get_parser_continuous_power, load_options
+from src.generator.sampling import sample_rng
+
+
+here = Path(__file__).resolve().parents[2] / "config"
+
+
+def get_sources(options, n):
+    """按配置采样 n 个热源矩阵, 3d 时沿 z 方向不变"""
+    from src.generator.generator import get_task
+
+    np.random.seed(options.seed)
+    task = get_task(options)
+    sources = []
+    for i in range(n):
+        F, _ = task.sample(rng=sample_rng(options.seed, i), index=i)
+        if options.ndim == 3:
+            F = np.repeat(F[None], F.shape[0], axis=0)
+        sources.append(F)
+    return sources
+
+
+def get_bench_solver(options, nx, method, params):
+    """lu / cg 为 fenics 求解器, fd / spectral / multigrid 为有限差分求解器"""
+    nz = nx if options.ndim == 3 else None
+    if method in ["fd", "spectral"]:
+        from src.generator.solver_fd import get_solver
+
+        return get_solver(options.length, options.bcs, options.u_D, nx, nx, nz, method=method)
+    if method == "multigrid":
+        from src.generator.solver_fd import get_solver
+
+        mg_params = {k: params[k] for k in ["rtol", "atol", "max_iter", "cycle"]}
+        return get_solver(options.length, options.bcs, options.u_D, nx, nx, nz, method=method, **mg_params)
+
+    from src.generator.solver import get_solver
+
+    params = {k: params[k] for k in ["preconditioner", "rtol", "atol", "max_iter"]}
+    params["linear_solver"] = method
+    return get_solver(options.length, options.bcs, options.u_D, nx, nx, nz, **params)
+
+
+def bench_case(options, nx, sources, method, params):
+    """在单独的进程中求解, 统计时间、迭代次数与峰值内存"""
+    t0 = time.perf_counter()
+    solver = get_bench_solver(options, nx, method, params)
+    setup = time.perf_counter() - t0
+
+    times, iterations, cycles, fields = [], [], [], []
+    for F in sources:
+        t0 = time.perf_counter()
+        u = solver.solve(F)
+        times.append(time.perf_counter() - t0)
+        iterations.append(getattr(solver, "iterations", 1))
+        # 多重网格每次迭代 (一次循环) 的耗时
+        cycles.extend(getattr(solver, "cycle_times", []))
+        fields.append(u if isinstance(u, np.ndarray) else u.compute_vertex_values())
+    return dict(
+        setup=setup,
+        first=times[0],
+        solve=float(np.mean(times[1:] if len(times) > 1 else times)),
+        iterations=float(np.mean(iterations)),
+        cycle=float(np.mean(cycles)) if cycles else float("nan"),
+        memory=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        fields=np.stack(fields),
+    )
+
+
+def run_benchmark(configs, nxs=None, solvers=("lu", "cg"), samples=5, **params):
+    """对每个配置、网格和求解器计时, 误差相对于同一网格上第一个求解器的解
+
+    With ``lu`` first, the ``max|du|`` column of ``fd`` and ``spectral`` is
+    their validation against the fenics solution on the same grid.
+    """
+    rows = []
+    for config in configs:
+        options = load_options(config)
+        sources = get_sources(options, samples)
+        for nx in nxs or [options.nx]:
+            reference = None
+            for method in solvers:
+                # 每个用例一个新进程, 峰值内存互不影响, 内存不足时只影响该用例
+                try:
+                    with ProcessPoolExecutor(1) as executor:
+                        result = executor.submit(
+                            bench_case, options, nx, sources, method, params
+                        ).result()
+                except (BrokenProcessPool, RuntimeError, ImportError) as e:
+                    print(f"{Path(config).name} nx={nx} {method}: failed ({e})")
+                    continue
+                fields = result.pop("fields")
+                if reference is None:
+                    reference = fields
+                result["error"] = float(np.abs(fields - reference).max())
+                rows.append(dict(result, config=Path(config).name, nx=nx, solver=method))
+                print_row(rows[-1])
+    return rows
+
+
+def bench_mesh(options, nx, sources, footprint, mesh, size, levels=0, degree=1):
+    """在 uniform, coarse 或 adaptive 网格上求解并插值到 nx 均匀网格"""
+    from src.generator.solver import PoissonSolver, get_mesh, get_adaptive_mesh
+
+    t0 = time.perf_counter()
+    if mesh == "adaptive":
+        fem_mesh = get_adaptive_mesh(options.length, options.bcs, footprint, size, levels)
+    else:
+        fem_mesh = get_mesh(options.length, size, size)
+    solver = PoissonSolver(options.length, options.bcs, options.u_D, nx, nx, degree=degree, mesh=fem_mesh)
+    setup = time.perf_counter() - t0
+
+    times, fields = [], []
+    for F in sources:
+        t0 = time.perf_counter()
+        solver.solve(F)
+        times.append(time.perf_counter() - t0)
+        fields.append(solver.vertex_values())
+    return dict(
+        dofs=solver.V.dim(),
+        setup=setup,
+        solve=float(np.mean(times)),
+        fields=np.stack(fields),
+    )
+
+
+def run_convergence(
+    configs, nx=None, samples=2, ref_factor=4, sizes=None, adaptive=((50, 2),), coarse=((50, 2),)
+):
+    """uniform, coarse 与 adaptive 网格相对于 ref_factor 倍加密均匀网格的误差
+
+    All solutions are sampled onto the same ``nx`` output grid, so the
+    ``max|du|`` and ``rms`` columns measure what the dataset would see.
+    """
+    rows = []
+    for config in configs:
+        options = load_options(config)
+        if options.ndim != 2:
+            print(f"{Path(config).name}: adaptive mesh only supports 2d, skipped")
+            continue
+        n = nx or options.nx
+        sources = get_sources(options, samples)
+        footprint = np.any(np.stack(sources) != 0, axis=0)
+        # (网格, 单元数, 加密层数, 次数)
+        cases = [("uniform", n * ref_factor, 0, 1)]
+        cases += [("uniform", size, 0, 1) for size in sizes or [n // 2, n]]
+        cases += [("coarse", size, 0, degree) for size, degree in coarse]
+        cases += [("adaptive", base, levels, 1) for base, levels in adaptive]
+        reference = None
+        for mesh, size, levels, degree in cases:
+            try:
+                with ProcessPoolExecutor(1) as executor:
+                    result = executor.submit(
+                        bench_mesh, options, n, sources, footprint, mesh, size, levels, degree
+                    ).result()
+            except (BrokenProcessPool, RuntimeError, ImportError) as e:
+                print(f"{Path(config).name} {mesh} {size}: failed ({e})")
+                continue
+            fields = result.pop("fields")
+            if reference is None:
+                reference = fields
+            du = fields - reference
+            result.update(error=float(np.abs(du).max()), rms=float(np.sqrt(np.mean(du ** 2))))
+            name = f"{mesh}-{size}" + (f"/{levels}" if mesh == "adaptive" else f"-P{degree}")
+            rows.append(dict(result, config=Path(config).name, nx=n, mesh=name))
+            print(
+                f"{rows[-1]['config']:<24}{n:>6}  {name:<16}{result['dofs']:>10}"
+                f"{result['setup']:>9.3f}{result['solve']:>9.4f}"
+                f"{result['error']:>12.3e}{result['rms']:>12.3e}"
+            )
+    return rows
+
+
+def print_row(row):
+    print(
+        f"{row['config']:<24}{row['nx']:>6}  {row['solver']:<10}"
+        f"{row['setup']:>9.3f}{row['first']:>9.3f}{row['solve']:>9.4f}"
+        f"{row['iterations']:>8.1f}{row['cycle'] * 1e3:>11.2f}{row['memory']:>10.1f}"
+        f"{row['error']:>12.3e}"
+    )
+
+
+def main():
+    parser = configargparse.ArgumentParser(description="benchmark of the solver backends")
+    parser.add("--configs", nargs="+", default=sorted(str(p) for p in here.glob("*.yml")))
+    parser.add("--nx", type=int, nargs="+", help="mesh cells per direction (default: from config)")
+    parser.add(
+        "--solvers", nargs="+", default=["lu", "cg"], choices=["lu", "cg", "fd", "spectral", "multigrid"]
+    )
+    parser.add("--samples", type=int, default=5, help="solves per case")
+    parser.add("--preconditioner", type=str, default="amg")
+    parser.add("--rtol", type=float, default=1e-10)
+    parser.add("--atol", type=float, default=1e-12)
+    parser.add("--max_iter", type=int, default=1000)
+    parser.add("--mg_cycle", type=str, default="V", choices=["V", "F"])
+    parser.add(
+        "--convergence",
+        action="store_true",
+        help="compare uniform, coarse and adaptive fenics meshes against a refined uniform mesh",
+    )
+    parser.add("--ref_factor", type=int, default=4, help="refinement of the reference mesh")
+    parser.add("--mesh_sizes", type=int, nargs="+", help="uniform mesh sizes (default: nx / 2, nx)")
+    parser.add(
+        "--adaptive", type=int, nargs=2, action="append", metavar=("BASE", "LEVELS"),
+        help="adaptive mesh base size and refinement levels (repeatable, default: 50 2)",
+    )
+    parser.add(
+        "--coarse", type=int, nargs=2, action="append", metavar=("SIZE", "DEGREE"),
+        help="coarse mesh size and element degree (repeatable, default: 50 2)",
+    )
+    args = parser.parse_args()
+
+    if args.convergence:
+        print(
+            f"{'config':<24}{'nx':>6}  {'mesh':<16}{'dofs':>10}{'setup':>9}{'solve':>9}"
+            f"{'max|du|':>12}{'rms':>12}"
+        )
+        run_convergence(
+            args.configs,
+            args.nx[0] if args.nx else None,
+            args.samples,
+            ref_factor=args.ref_factor,
+            sizes=args.mesh_sizes,
+            adaptive=[tuple(a) for a in args.adaptive] if args.adaptive else [(50, 2)],
+            coarse=[tuple(c) for c in args.coarse] if args.coarse else [(50, 2)],
+        )
+        return
+
+    print(
+        f"{'config':<24}{'nx':>6}  {'solver':<10}{'setup':>9}{'first':>9}{'solve':>9}"
+        f"{'iters':>8}{'cycle(ms)':>11}{'mem(MB)':>10}{'max|du|':>12}"
+    )
+    run_benchmark(
+        args.configs,
+        args.nx,
+        args.solvers,
+        args.samples,
+        preconditioner=args.preconditioner,
+        rtol=args.rtol,
+        atol=args.atol,
+        max_iter=args.max_iter,
+        cycle=args.mg_cycle,
+    )
+
+
+if __name__ == "__main__":
+    main()
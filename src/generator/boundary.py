@@ -13,10 +13,19 @@ import numpy as np
 
 TOL = 1e-10
 
+# 线段 (或其沿 z 方向的延伸面) 上的边界点, 参数为线段端点
+SEGMENT = (
+    "on_boundary && x[0] >= lx - tol && x[0] <= rx + tol"
+    " && x[1] >= ly - tol && x[1] <= ry + tol"
+)
 
 class AllBoundary:
     """边界定义
 
+    The Dirichlet segments are marked on a facet MeshFunction with
+    compiled subdomains, so building a DirichletBC never calls back into
+    Python. ``PoissonSolver`` builds the boundary conditions once and keeps
+    them, together with their DOF index sets, for all its solves.
     """
 
     def __init__(self, V, bds, u_D=298):
@@ -26,24 +35,44 @@ class AllBoundary:
         self.V = V
 
     def get_boundary(self):
+        markers = boundary_markers(self.V.mesh(), self.bds)
         bcs = []
-        for bd in self.bds:
-            assert (len(bd) == 2 or len(bd) == 3), 'Error Boundary!'
-            if bd[0] == 'sink':
-                u0 = self.u_D if len(bd)==2 else bd[2]
-                boundary = LineBoundary(bd[1],u0)
-                bc = fs.DirichletBC(self.V, boundary.expression(), boundary.get_boundary())
-                bcs.append(bc)
-            elif bd[0] == 'sine-wave':
-                u0 = self.u_D if len(bd)==3 else bd[2]
-                um = bd[2] if len(bd)==3 else bd[3]
-                boundary = SineBoundary(bd[1],u0,um)
-                bc = fs.DirichletBC(self.V, boundary.expression(), boundary.get_boundary())
-                bcs.append(bc)
-            else:
-                LookupError(f'Boundary condition {bc[0]} is not supported (sink, sine-wave)!')
+        for k, boundary in enumerate(self.boundaries()):
+            bcs.append(fs.DirichletBC(self.V, boundary.expression(), markers, k + 1))
         return bcs
 
+    def boundaries(self):
+        return get_boundaries(self.bds, self.u_D)
+
+
+def get_boundaries(bds, u_D=298):
+    """由边界定义构造 LineBoundary 与 SineBoundary"""
+    boundaries = []
+    for bd in bds:
+        assert (len(bd) == 2 or len(bd) == 3), 'Error Boundary!'
+        if bd[0] == 'sink':
+            u0 = u_D if len(bd)==2 else bd[2]
+            boundaries.append(LineBoundary(bd[1],u0))
+        elif bd[0] == 'sine-wave':
+            u0 = u_D if len(bd)==3 else bd[2]
+            um = bd[2] if len(bd)==3 else bd[3]
+            boundaries.append(SineBoundary(bd[1],u0,um))
+        else:
+            raise LookupError(f'Boundary condition {bd[0]} is not supported (sink, sine-wave)!')
+    return boundaries
+
+
+def boundary_markers(mesh, bds):
+    """边界面标记, 第 k 个边界标记为 k + 1, 其余为 0
+
+    Later segments overwrite earlier ones on shared facets, the same
+    precedence as applying the boundary conditions in order.
+    """
+    markers = fs.MeshFunction("size_t", mesh, mesh.topology().dim() - 1, 0)
+    for k, boundary in enumerate(get_boundaries(bds)):
+        boundary.compiled().mark(markers, k + 1)
+    return markers
+
 
 class LineBoundary:
     """线段边界
@@ -66,6 +95,10 @@ class LineBoundary:
         u_D = fs.Constant(self.u0)
         return u_D
 
+    def compiled(self):
+        """编译后的边界, 与 get_boundary 等价"""
+        return compiled_segment(self.line)
+
     def get_boundary(self):
         """构造 fenics 所需 bc 函数
 
@@ -113,6 +146,10 @@ class SineBoundary:
             degree=2, t0=self.interval[0,1],length=length, um=self.um, u0=self.u0)
         return u_D
 
+    def compiled(self):
+        """编译后的边界, 与 get_boundary 等价"""
+        return compiled_segment(self.interval)
+
     def get_boundary(self):
         """构造 fenics 所需 bc 函数
 
@@ -131,3 +168,10 @@ class SineBoundary:
             return False
 
         return boundary
+
+
+def compiled_segment(line):
+    (lx, ly), (rx, ry) = line
+    return fs.CompiledSubDomain(
+        SEGMENT, lx=float(lx), ly=float(ly), rx=float(rx), ry=float(ry), tol=TOL
+    )
@@ -7,21 +7,30 @@ Desc      :   Main function for generator.
 # Author  :   Zhiqiang Gong
 # Contact :   gongzhiqiang13@nudt.edu.cn
 
+import time
+import queue
+import signal
 from functools import partial
+from pathlib import Path
 import numpy as np
 import tqdm
 import configargparse
 from scipy.interpolate import griddata
-from multiprocessing import Pool, Queue
+import multiprocessing
+from multiprocessing import Pool
 import matplotlib.pyplot as plt
 
-from src.generator.solver import run_solver
 import src.data.data_processing as data_processing
-from src.generator.sampling import get_task_powers_sampling
+from src.generator.sampling import get_task_powers_sampling, sample_rng
 from src.generator.monitoring import Monitor
+from src.generator.superposition import SuperpositionBasis, unit_footprint
+from src.data.writer import AsyncWriter, QueueSaver
+from src.generator.lease import LeaseScheduler
 
 
 TOL = 1e-5
+POLL_INTERVAL = 1.0  # 等待工作进程时检查写进程状态的间隔 (s)
+INTERRUPT_TIMEOUT = 30.0  # Ctrl-C 后等待写进程写完队列中样本的时间 (s)
 
 
 def generate_from_cli(options: configargparse.Namespace):
@@ -31,16 +40,168 @@ def generate_from_cli(options: configargparse.Namespace):
         options (configargparse.Namespace): config options
     """
     print('Starting...')
+    start, stop = sample_range(options)
+    data_processing.check_storage(options)
+    # 其他机器可能正在写入共享目录, 只删除超过租约超时未修改的临时文件
+    data_processing.remove_tmp(options, options.lease_timeout if options.distributed else 0.0)
+
+    # 只读状态在工作进程初始化时传入一次, 之后只分发样本序号区间
+    state = get_state(options)
+    if state["observations"] is not None:
+        # 每个样本只存储测点上的值, 测点索引只存储一次
+        data_processing.save_observations(options, state["observations"])
+
+    if options.file_format == "lazy":
+        # 只存储叠加基与每个样本的组件有效功率, 读取时再构造温度场
+        if stop > options.sample_n:
+            raise ValueError("Lazy format cannot go beyond sample_n!")
+        if state["basis"] is None:
+            state["basis"] = get_basis(options, state["task"])
+        data_processing.save_basis(options, state["basis"], state["monitor"])
+        state["method"] = method_lazy
+
+    scheduler = None
+    if options.distributed:
+        # 多机共享 data_dir, 通过租约文件申请样本块
+        scheduler = LeaseScheduler(
+            lease_dir(options),
+            start,
+            stop,
+            block=options.lease_block,
+            timeout=options.lease_timeout,
+            plan=dict(seed=options.seed, prefix=options.prefix, file_format=options.file_format),
+        )
+    indices = range(start, stop)
+    if scheduler is None:
+        if options.resume:
+            done = data_processing.completed_indices(options, indices)
+            indices = [i for i in indices if i not in done]
+            print(f"Resuming: {len(done)} of {stop - start} samples already generated")
+        chunks = index_chunks(indices, get_chunksize(options, len(indices)))
+
+    # 后台写数据进程, 求解与写盘并行
+    writer = None
+    if options.write_queue > 0 and options.file_format != "lazy":
+        writer = AsyncWriter(options, options.write_queue)
+    pending = []
+    # 置位后工作进程写完当前样本即返回
+    cancel = multiprocessing.Event()
+    interrupted = False
+    try:
+        # multiprocess support
+        with Pool(
+            options.worker,
+            initializer=pool_init,
+            initargs=(state, writer.queue if writer else None, writer.failed if writer else None, cancel),
+        ) as pool:
+            try:
+                with tqdm.tqdm(
+                    desc=f"{pool._processes} workers's running",
+                    total=len(indices),
+                    ncols=100,
+                ) as pbar:
+                    if scheduler is None:
+                        results = pool.imap_unordered(generate_range, chunks)
+                        while True:
+                            try:
+                                k = results.next(timeout=POLL_INTERVAL)
+                            except StopIteration:
+                                break
+                            except multiprocessing.TimeoutError:
+                                # 写进程退出时工作进程会阻塞在满队列上, 退出 with 时终止进程池
+                                if writer is not None:
+                                    writer.check()
+                                continue
+                            pbar.update(k)
+                            if writer is not None:
+                                writer.check()
+                                pbar.set_postfix(queue=writer.qsize(), refresh=False)
+                    else:
+                        scheduler.start_heartbeat()
+                        pending = run_leases(pool, scheduler, options, writer, pbar)
+                    n = pbar.n
+            except KeyboardInterrupt:
+                # 工作进程忽略 Ctrl-C: 终止工作进程可能使队列中留下不完整的消息,
+                # 让其写完当前样本后正常退出, 再由写进程写完队列中的样本
+                interrupted = True
+                print("Interrupted, waiting for the workers to finish their current samples...")
+                cancel.set()
+                pool.close()
+                pool.join()
+                raise
+            # 正常退出工作进程, 保证队列中的样本全部发出
+            pool.close()
+            pool.join()
+    finally:
+        if writer is not None:
+            # 再次 Ctrl-C 时进程池被终止, 队列可能不完整, 只等待较短时间
+            writer.close(INTERRUPT_TIMEOUT if interrupted else 600.0)
+        if scheduler is not None:
+            # 写进程退出后确认最后几块, 未写完的租约释放给其他进程
+            complete_leases(scheduler, options, pending, final=True)
+            scheduler.close()
+    if writer is not None:
+        # 队列中最后几批样本写入失败时同样报错
+        writer.check()
+
+    print(f"Generated {n} layouts ({start} to {stop - 1}) in {options.data_dir}")
+    written = data_processing.journal_indices(options)
+    if written:
+        nbytes = data_processing.dataset_bytes(options)
+        print(
+            f"Dataset {options.prefix}: {nbytes / 2 ** 20:.1f} MB, "
+            f"{nbytes / len(written):.0f} bytes per sample ({options.dtype}, compression {options.compression})"
+        )
+
+
+def get_state(options):
+    """构造布局、测点与求解方法, 即工作进程共享的只读状态
+
+    ``method`` solves and writes sample ``i``, ``sample`` solves and returns
+    it (see ``generate_batch``).
+    """
     if options.bcs is None:
         options.bcs = []
+    # 布局和测点由 seed 确定; 每个样本的随机数由 (seed, 样本序号) 确定
     np.random.seed(options.seed)
-    seeds = np.random.randint(2 ** 32, size=options.worker)
-    seeds_q: Queue = Queue()
-    for seed in seeds:
-        seeds_q.put(seed)
 
-    unit_n = len(options.units)
+    task = get_task(options)
+    monitor = Monitor(task.components, options.monitoring_sampling).sampling()
+    observations = None
+    if options.sparse_obs:
+        observations = data_processing.Observations.from_mask(monitor, (options.nx + 1,) * options.ndim)
+
+    basis = None
+    if options.method in ["fenics", "fd", "spectral", "multigrid"]:
+        method, sample = method_fenics, sample_fenics
+    elif options.method == "superposition":
+        basis = get_basis(options, task)
+        method, sample = method_superposition, sample_superposition
+    else:
+        raise LookupError(f"Method {options.method} is not supported!")
+
+    return dict(
+        options=options,
+        method=method,
+        sample=sample,
+        task=task,
+        monitor=monitor,
+        observations=observations,
+        basis=basis,
+        # 布局不变, 自适应网格只需在各工作进程中生成一次
+        footprint=unit_footprint(task.components) if options.mesh == "adaptive" else None,
+    )
+
 
+def get_basis(options, task):
+    """每个组件只求解一次单位功率场"""
+    if task.is_overlaping():
+        raise ValueError('Existing overlaping, Layout Error!')
+    return SuperpositionBasis.from_options(options, task.components, worker=options.worker)
+
+
+def get_task(options):
+    """由参数构造布局与功率采样任务"""
     positions = np.array([k for k in options.positions])
     if options.positions_type == "coord":
         pass
@@ -49,7 +210,7 @@ def generate_from_cli(options: configargparse.Namespace):
     else:
         raise LookupError(f"Type {options.positions_type} is not supported!")
 
-    task = get_task_powers_sampling(
+    return get_task_powers_sampling(
         geometry_board="s",
         size_board=options.length,
         grid_board=options.nx + 1,
@@ -63,54 +224,248 @@ def generate_from_cli(options: configargparse.Namespace):
         special = options.special,
         special_num = options.special_num,
         rad=False,
+        rotation=options.rotation,
+        power_sampling=options.power_sampling,
+        sample_n=options.sample_n,
+        seed=options.seed,
     )
 
-    PMonitor = Monitor(task.components, options.monitoring_sampling)
 
-    if options.method == "fenics":
-        # 创建单参数函数
+# 工作进程中的只读状态, 由 pool_init 设置
+_state = {}
+_basis = None
+_saver = None
+_cancel = None
+
+
+def pool_init(state=None, write_queue=None, write_failed=None, cancel=None):
+    global _state, _basis, _saver, _cancel
+    # Ctrl-C 由主进程处理, 工作进程不会在写队列时被中断
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _cancel = cancel
+    _state = state or {}
+    _basis = _state.get("basis")
+    _saver = QueueSaver(write_queue, write_failed) if write_queue is not None else None
+
+
+def sample_range(options):
+    """本次生成的样本序号区间 [start, stop)"""
+    start = options.start or 0
+    stop = options.sample_n if options.stop is None else options.stop
+    if not 0 <= start <= stop:
+        raise ValueError(f"Wrong sample range [{start}, {stop})!")
+    if options.power_sampling == "lhs" and stop > options.sample_n:
+        raise ValueError("Latin hypercube sampling cannot go beyond sample_n!")
+    return start, stop
+
+
+def get_chunksize(options, n):
+    """每次分发给工作进程的样本数: 每个进程约分到 4 块, 最多 64 个样本"""
+    if options.chunksize > 0:
+        return options.chunksize
+    return int(max(1, min(64, n // (4 * options.worker))))
+
+
+def index_chunks(indices, chunksize):
+    """将样本序号划分为每块 chunksize 个"""
+    indices = list(indices)
+    return [indices[k:k + chunksize] for k in range(0, len(indices), chunksize)]
+
+
+def generate_range(indices):
+    """在工作进程中生成一块样本, 返回生成的样本数"""
+    task = _state["task"]
+    n = 0
+    for i in indices:
+        if _cancel is not None and _cancel.is_set():
+            break
+        _state["method"](
+            i,
+            options=_state["options"],
+            sampler=task.sample,
+            task=task,
+            monitor=_state["monitor"],
+        )
+        n += 1
+    return n
+
+
+def generate_batch(indices):
+    """在工作进程中生成一批样本并返回, 不写盘
 
-        method_fenics_p = partial(
-            method_fenics,
+    Returns:
+        dict: index, u, F, u_obs 按样本堆叠, 以及 xs, ys, zs, u_pos
+    """
+    options = _state["options"]
+    task = _state["task"]
+    samples = [
+        _state["sample"](
+            i,
             options=options,
             sampler=task.sample,
             task=task,
-            monitor=PMonitor.sampling(),
+            monitor=_state["monitor"],
         )
+        for i in indices
+    ]
+    U, xs, ys, F, U_obs = zip(*samples)
+    dtype = np.dtype(options.dtype)
+    return dict(
+        index=np.array(indices),
+        u=data_processing.to_dtype(np.stack(U), dtype, "u"),
+        F=data_processing.to_dtype(np.stack(F), dtype, "F"),
+        u_obs=data_processing.to_dtype(np.stack(U_obs), dtype, "u_obs"),
+        xs=xs[0],
+        ys=ys[0],
+        zs=[],
+        u_pos=_state["monitor"],
+    )
+
+
+def lease_dir(options):
+    return Path(options.data_dir) / f"{options.prefix}.leases"
+
+
+def run_leases(pool, scheduler, options, writer, pbar, blocks_in_flight=2):
+    """分布式模式: 申请租约并把块内未完成的样本分发给工作进程
+
+    Keeps ``blocks_in_flight`` blocks submitted so workers do not idle at
+    the tail of a block. A block is marked done once its samples are in the
+    completion journal. When nothing is claimable, the process waits for
+    the other hosts and reclaims the leases of those that die. Returns the
+    leases whose samples are still queued for writing.
+    """
+    results = queue.Queue()
+    active = {}  # 块起始序号 -> [租约, 未完成的任务数]
+    pending = []
+    waiting = False
+    while True:
+        while len(active) < blocks_in_flight:
+            lease = scheduler.claim()
+            if lease is None:
+                break
+            done = data_processing.completed_indices(options, lease.indices)
+            todo = [i for i in lease.indices if i not in done]
+            chunks = index_chunks(todo, get_chunksize(options, len(todo)))
+            if not chunks:
+                scheduler.complete(lease)
+                continue
+            active[lease.start] = [lease, len(chunks)]
+            for chunk in chunks:
+                pool.apply_async(
+                    generate_range,
+                    (chunk,),
+                    callback=partial(lambda s, k: results.put((s, k, None)), lease.start),
+                    error_callback=lambda e: results.put((None, 0, e)),
+                )
+
+        if not active:
+            pending = complete_leases(scheduler, options, pending)
+            if not pending and scheduler.finished():
+                return pending
+            if not waiting:
+                pbar.set_postfix_str("waiting for other hosts")
+                waiting = True
+            time.sleep(min(1.0, scheduler.timeout / 4))
+            continue
+
+        try:
+            start, k, error = results.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            if writer is not None:
+                writer.check()
+            continue
+        if error is not None:
+            raise error
+        waiting = False
+        pbar.update(k)
+        if writer is not None:
+            pbar.set_postfix(queue=writer.qsize(), refresh=False)
+        active[start][1] -= 1
+        if active[start][1] == 0:
+            pending.append(active.pop(start)[0])
+        pending = complete_leases(scheduler, options, pending)
+
+
+def complete_leases(scheduler, options, pending, final=False):
+    """样本已全部写入完成日志的块标记为完成, 返回其余租约
+
+    With ``final`` the writer has exited, so the remaining leases are
+    released for other hosts instead of being kept.
+    """
+    if not pending:
+        return pending
+    written = data_processing.journal_indices(options) or set()
+    remaining = []
+    for lease in pending:
+        if all(i in written for i in lease.indices):
+            scheduler.complete(lease)
+        elif final:
+            scheduler.release(lease)
+        else:
+            remaining.append(lease)
+    return remaining
 
-        # multiprocess support
-        with Pool(
-            options.worker, initializer=pool_init, initargs=(seeds_q,)
-        ) as pool:
-            pool_it = pool.imap(method_fenics_p, range(options.sample_n))
-            # for i in pool_it:
-            #     print(i)
-            for _ in tqdm.tqdm(
-                pool_it,
-                desc=f"{pool._processes} workers's running",
-                total=options.sample_n,
-                ncols=100,
-            ):
-                pass
 
-    print(f"Generated {options.sample_n} layouts in {options.data_dir}")
+def save(options, i, U, xs, ys, F, U_obs, monitor, zs=None):
+    """写入后台队列, 未启用时直接写盘"""
+    if _saver is not None:
+        _saver.save(options, i, U, xs, ys, F, U_obs, monitor, zs=zs)
+    else:
+        data_processing.save(options, i, U, xs, ys, F, U_obs, monitor, zs=zs)
 
 
-def pool_init(seeds_q):
-    seed = seeds_q.get()
-    np.random.seed(seed)
+def observe(U, monitor):
+    """测点温度, sparse_obs 时只保留测点上的值"""
+    observations = _state.get("observations")
+    if observations is None:
+        return U * monitor
+    return observations.values(U)
 
 
 def method_fenics(i, options, sampler, task, monitor):
-    """采用 fenics 求解"""
+    """每个样本求解一次 (fenics, fd, spectral 或 multigrid)"""
+    U, xs, ys, F, U_obs = sample_fenics(i, options, sampler, task, monitor)
+
+    save(options, i, U, xs, ys, F, U_obs, monitor)
+
+
+def sample_fenics(i, options, sampler, task, monitor):
+    """求解第 i 个样本, 返回 U, xs, ys, F, U_obs"""
     while True:
-        F, flag = sampler()
+        F, flag = sampler(rng=sample_rng(options.seed, i), index=i)
         intensity = task.intensity_sample
         if flag:
             break
     if task.is_overlaping():
         raise ValueError('Existing overlaping, Layout Error!')
-    U, xs, ys, zs = run_solver(
+    U, xs, ys, zs = solve_field(F, options, footprint=_state.get("footprint"))
+
+    U_obs = observe(U, monitor)
+
+    return U, xs, ys, F, U_obs
+
+
+def solve_field(F, options, footprint=None):
+    """求解热源 F 对应的温度场, fd, spectral 与 multigrid 方法不需要 fenics
+
+    ``footprint`` (组件覆盖的网格) is used by the fenics adaptive mesh.
+    """
+    if options.method in ["fd", "spectral", "multigrid"]:
+        from src.generator.solver_fd import run_solver
+
+        params = dict(method=options.method)
+        if options.method == "multigrid":
+            params.update(
+                rtol=options.rtol, atol=options.atol, max_iter=options.max_iter, cycle=options.mg_cycle
+            )
+    else:
+        from src.generator.solver import run_solver, solver_params
+
+        params = solver_params(options)
+        if options.mesh == "adaptive":
+            params["footprint"] = footprint
+    return run_solver(
         options.ndim,
         options.length,
         options.units,
@@ -119,9 +474,28 @@ def method_fenics(i, options, sampler, task, monitor):
         options.nx,
         F,
         coordinates=True,
+        **params,
     )
 
-    U_obs = U * monitor
 
-    data_processing.save(options, i, U, xs, ys, F, U_obs, monitor)
+def method_superposition(i, options, sampler, task, monitor):
+    """由单位功率场线性叠加得到温度场"""
+    U, xs, ys, F, U_obs = sample_superposition(i, options, sampler, task, monitor)
+
+    save(options, i, U, xs, ys, F, U_obs, monitor)
+
+
+def sample_superposition(i, options, sampler, task, monitor):
+    """叠加得到第 i 个样本, 返回 U, xs, ys, F, U_obs"""
+    F, _ = sampler(rng=sample_rng(options.seed, i), index=i)
+    U = _basis.field(task.weights)
+
+    U_obs = observe(U, monitor)
+
+    return U, _basis.xs, _basis.ys, F, U_obs
+
 
+def method_lazy(i, options, sampler, task, monitor):
+    """lazy 格式: 只写入组件有效功率"""
+    sampler(rng=sample_rng(options.seed, i), index=i)
+    data_processing.save_weights(options, [(i, task.weights)])
@@ -0,0 +1,220 @@
+# -*- encoding: utf-8 -*-
+"""
+Desc      :   File-lease scheduling of sample blocks on a shared data dir.
+"""
+# File    :   lease.py
+
+import os
+import json
+import socket
+import threading
+from pathlib import Path
+
+
+class Lease:
+    """一个样本块的租约
+
+    Args:
+        start (int): 块内第一个样本序号
+        stop (int): 块内样本序号上界
+        gen (int): 租约代数, 每次回收失效租约加 1
+        path (Path): 租约文件
+    """
+
+    def __init__(self, start, stop, gen, path):
+        self.start = start
+        self.stop = stop
+        self.gen = gen
+        self.path = path
+        self.ino = None
+        self.lost = False
+
+    @property
+    def indices(self):
+        return range(self.start, self.stop)
+
+
+class LeaseScheduler:
+    """无中心节点的分布式样本调度
+
+    The sample range is cut into blocks of ``block`` samples. A process owns
+    a block while it holds the lease file ``{start}.{gen}.lease`` in
+    ``lease_dir``, created with O_CREAT | O_EXCL so exactly one process wins,
+    and a heartbeat thread keeps refreshing its mtime. A lease whose mtime
+    is older than ``timeout`` belongs to a dead host and is reclaimed by
+    creating the next generation ``{start}.{gen + 1}.lease``, again with
+    O_EXCL, so concurrent reclaimers cannot both win. Finished blocks get a
+    ``{start}.done`` marker. Ages are measured against the mtime of a file
+    touched by this process, i.e. in file server time, so clock skew
+    between hosts does not matter.
+
+    Args:
+        lease_dir (str): 共享目录中的租约目录
+        start (int): 第一个样本序号
+        stop (int): 样本序号上界
+        block (int): 每个租约的样本数
+        timeout (float): 租约失效时间 (s)
+        plan (dict): 生成参数, 所有进程必须一致
+    """
+
+    def __init__(self, lease_dir, start, stop, block=64, timeout=60.0, plan=None):
+        if block <= 0:
+            raise ValueError(f"Wrong lease block size {block}!")
+        if timeout <= 0:
+            raise ValueError(f"Wrong lease timeout {timeout}!")
+        self.dir = Path(lease_dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.start = start
+        self.stop = stop
+        self.block = block
+        self.timeout = timeout
+        self.owner = f"{socket.gethostname()}-{os.getpid()}"
+        self.blocks = list(range(start, stop, block))
+        self.held = {}
+        self._clock = self.dir / f".clock-{self.owner}"
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._heartbeat = None
+        self.check_plan(dict(plan or {}, start=start, stop=stop, block=block))
+
+    def check_plan(self, plan):
+        """第一个进程写入 plan.json, 之后的进程检查参数是否一致"""
+        path = self.dir / "plan.json"
+        tmp_path = self.dir / f".plan-{self.owner}"
+        with open(tmp_path, "w") as f:
+            json.dump(plan, f, sort_keys=True)
+        try:
+            # link 在目标已存在时失败, 保证 plan.json 只写入一次且完整
+            os.link(tmp_path, path)
+        except FileExistsError:
+            with open(path) as f:
+                existing = json.load(f)
+            if existing != json.loads(json.dumps(plan)):
+                raise ValueError(
+                    f"{self.dir} belongs to a run with other options: {existing}"
+                )
+        finally:
+            tmp_path.unlink()
+
+    def start_heartbeat(self):
+        """启动心跳线程"""
+        self._heartbeat = threading.Thread(target=self._beat, daemon=True)
+        self._heartbeat.start()
+
+    def close(self):
+        """停止心跳并释放所有未完成的租约"""
+        self._stop_event.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+        for lease in list(self.held.values()):
+            self.release(lease)
+        _unlink(self._clock)
+
+    def claim(self):
+        """申请一个未完成的块, 没有可申请的块时返回 None"""
+        leases, done = self._scan()
+        now = self._now()
+        for start in self.blocks:
+            if start in done or start in self.held:
+                continue
+            gen = 0
+            if start in leases:
+                gen, path = leases[start]
+                try:
+                    age = now - path.stat().st_mtime
+                except FileNotFoundError:
+                    # 刚被释放或完成, 下次扫描再处理
+                    continue
+                if age < self.timeout:
+                    continue
+                gen += 1
+            lease = self._create(start, gen)
+            if lease is not None:
+                if gen > 0:
+                    _unlink(self._path(start, gen - 1))
+                return lease
+        return None
+
+    def finished(self):
+        """所有块都已完成"""
+        _, done = self._scan()
+        return all(start in done for start in self.blocks)
+
+    def complete(self, lease):
+        """写入完成标记并释放租约"""
+        with open(self.dir / f"{lease.start}.done", "w") as f:
+            f.write(self.owner)
+        self.release(lease)
+
+    def release(self, lease):
+        with self._lock:
+            self.held.pop(lease.start, None)
+        if not lease.lost:
+            _unlink(lease.path)
+
+    def _create(self, start, gen):
+        path = self._path(start, gen)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return None
+        lease = Lease(start, min(start + self.block, self.stop), gen, path)
+        try:
+            os.write(fd, self.owner.encode())
+            lease.ino = os.fstat(fd).st_ino
+        finally:
+            os.close(fd)
+        with self._lock:
+            self.held[start] = lease
+        return lease
+
+    def _path(self, start, gen):
+        return self.dir / f"{start}.{gen}.lease"
+
+    def _scan(self):
+        """当前最高代的租约 {start: (gen, path)} 与已完成的块"""
+        leases, done = {}, set()
+        for name in os.listdir(self.dir):
+            fields = name.split(".")
+            if not fields[0].isdigit():
+                continue
+            start = int(fields[0])
+            if len(fields) == 2 and fields[1] == "done":
+                done.add(start)
+            elif len(fields) == 3 and fields[2] == "lease" and fields[1].isdigit():
+                gen = int(fields[1])
+                if start not in leases or gen > leases[start][0]:
+                    leases[start] = (gen, self.dir / name)
+        return leases, done
+
+    def _now(self):
+        """共享文件系统上的当前时间"""
+        self._clock.touch()
+        return self._clock.stat().st_mtime
+
+    def _beat(self):
+        """心跳线程: 定期刷新持有的租约, 发现被回收的租约时标记为 lost"""
+        while not self._stop_event.wait(self.timeout / 4):
+            with self._lock:
+                leases = list(self.held.values())
+            for lease in leases:
+                if lease.lost:
+                    continue
+                if self._path(lease.start, lease.gen + 1).exists():
+                    lease.lost = True
+                    print(f"Lease of block {lease.start} was taken over by another host")
+                    continue
+                try:
+                    # 文件被删除或替换说明租约已被其他进程接管
+                    if lease.path.stat().st_ino != lease.ino:
+                        raise FileNotFoundError(lease.path)
+                    os.utime(lease.path)
+                except FileNotFoundError:
+                    lease.lost = True
+
+
+def _unlink(path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
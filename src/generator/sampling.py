@@ -9,7 +9,10 @@ Desc      :   Power Sampling.
 
 import sys
 import math
+import warnings
 import numpy as np
+from scipy import stats
+from scipy.stats import qmc
 from typing import Sequence
 
 from src.data.base import Task, Components, Domain
@@ -19,70 +22,192 @@ TOL = 1e-10
 
 
 class TaskPowersSampling(Task):
-    def __init__(self, components: Components):
+    def __init__(self, components: Components, design=None):
         super(TaskPowersSampling, self).__init__(components)
         self.overlap = None
         self.F = None
-        self.sample()
+        self.weights = None
+        # 每个组件的功率采样器只编译一次
+        self.power_samplers = [PowerSampler(p) for p in components.intensity]
+        # 联合采样设计 (sobol, halton, lhs), None 表示各组件独立随机采样
+        self.design = design
+        self.sample(index=0)
+
+    def sample(self, rng=np.random, index=None):
+        """在给定布局情况下，随机对功率进行采样，获得布局对应的F
+
+        Args:
+            rng: numpy.random.Generator, 默认为全局 np.random
+            index (int): 样本序号, 使用联合采样设计时必须给出
+        """
+
+        intensity = self.sample_intensity(rng, index=index)
+        fm = FMatrix(self.components, intensity)
+        self.F, self.overlap = fm.com2matrix(rng)
+        self.weights = fm.weights
+        return self.F, True
 
-    def sample(self):
-        """在给定布局情况下，随机对功率进行采样，获得布局对应的F"""
+    def sample_batch(self, n, rng=np.random, start=None):
+        """一次采样 n 个样本 (序号 start, ..., start + n - 1)
 
-        intensity = self.sample_intensity()
-        self.F, self.overlap = FMatrix(self.components, intensity).com2matrix()
-        return self.F, True
+        Returns:
+            F (ndarray): 热源矩阵, shape (n, grid, grid)
+            weights (ndarray): 组件有效功率, shape (n, number)
+        """
+        intensity = self.sample_intensity_batch(n, rng, start=start)
+        weights, _ = component_weights(intensity, self.components, rng)
+        unit_comgrid, _ = FMatrix(self.components, None).unit2matrix()
+        F = np.tensordot(weights, unit_comgrid, axes=1)
+        return F, weights
 
     def is_overlaping(self):
-       return (np.array(self.overlap) > 1 + 1e-5).any()
+        """组件布局固定, 每次运行只需判断一次"""
+        if self.components.overlaping is None:
+            _, overlap = FMatrix(self.components, None).unit2matrix()
+            self.components.overlaping = bool((overlap.sum(axis=0) > 1 + 1e-5).any())
+        return self.components.overlaping
 
-    def sample_intensity(self):
+    def sample_intensity(self, rng=np.random, index=None):
         """在给定布局情况下，随机对功率进行采样"""
 
-        intensity = []
-        for p in self.components.intensity:
-            if isinstance(p[0], str):
-                if p[0] == "uniform":  # 对功率进行区间内的随机采样
-                    if len(p) == 3:  # ["uniform", 10000, 20000]
-                        intensity.append(
-                            np.random.uniform(low=p[1], high=p[2])
-                        )
-                    elif (
-                        len(p) == 4
-                    ):  # ["uniform", 10000, 20000, interval=100]
-                        choice = range(p[1], p[2] + 1, p[3])
-                        intensity.append(np.random.choice(choice))
-                    else:
-                        raise ValueError(
-                            "The data format of powers is not right."
-                        )
-                elif p[0] == "normal":
-                    intensity.append(
-                        np.random.normal(p[1], p[2])
-                    )
-                elif p[0] == "lognormal":
-                    mean = p[1]
-                    std = p[2]
-                    var = std ** 2
-                    mu = math.log(mean ** 2 / math.sqrt(mean ** 2 + var))
-                    std = math.sqrt(math.log(1 + var / mean ** 2))
-                    intensity.append(
-                        np.random.lognormal(mu, std)
-                    )
-                elif p[0] == "gumbel":
-                    mean = p[1]
-                    std = p[2]
-                    var = std ** 2
-                    belta = math.sqrt(6 * var / (math.pi ** 2))
-                    mu = mean - 0.57721 * belta
-                    intensity.append(
-                        np.random.gumbel(mu, belta)
-                    )
+        self.intensity_sample = list(self.sample_intensity_batch(1, rng, start=index)[0])
+        return self.intensity_sample
+
+    def sample_intensity_batch(self, n, rng=np.random, start=None):
+        """对功率进行 n 次采样, 返回 shape (n, number)
+
+        Args:
+            n (int): 样本数
+            rng: numpy.random.Generator, 默认为全局 np.random
+            start (int): 第一个样本的序号, 使用联合采样设计时必须给出
+        """
+        if self.design is None:
+            return np.stack([sampler.sample(rng, n) for sampler in self.power_samplers], axis=1)
+        if start is None:
+            raise ValueError(f"Sample index is required by {self.design.method} power sampling.")
+        u = self.design.uniforms(start, start + n)
+        return np.stack([sampler.ppf(u[:, k]) for k, sampler in enumerate(self.power_samplers)], axis=1)
+
+
+class PowerSampler:
+    """单个组件的功率采样器
+
+    The power spec is parsed once, distribution parameters are derived once
+    and every call draws a whole block of samples.
+
+    Args:
+        p (list): 功率定义, 如 ["uniform", 10000, 20000], ["uniform", 10000, 20000, 100],
+            ["normal", mean, std], ["lognormal", mean, std], ["gumbel", mean, std],
+            [100000, 200000, 300000] 或 [10000]
+    """
+
+    def __init__(self, p):
+        self.p = p
+        if isinstance(p[0], str):
+            if p[0] == "uniform":  # 对功率进行区间内的随机采样
+                if len(p) == 3:  # ["uniform", 10000, 20000]
+                    self.method = "uniform"
+                    self.params = (p[1], p[2])
+                elif len(p) == 4:  # ["uniform", 10000, 20000, interval=100]
+                    self.method = "choice"
+                    self.params = (np.arange(p[1], p[2] + 1, p[3]),)
                 else:
-                    raise LookupError(f"Method {p[0]} does not supported!")
+                    raise ValueError("The data format of powers is not right.")
+            elif p[0] == "normal":
+                self.method = "normal"
+                self.params = (p[1], p[2])
+            elif p[0] == "lognormal":
+                mean = p[1]
+                std = p[2]
+                var = std ** 2
+                mu = math.log(mean ** 2 / math.sqrt(mean ** 2 + var))
+                std = math.sqrt(math.log(1 + var / mean ** 2))
+                self.method = "lognormal"
+                self.params = (mu, std)
+            elif p[0] == "gumbel":
+                mean = p[1]
+                std = p[2]
+                var = std ** 2
+                belta = math.sqrt(6 * var / (math.pi ** 2))
+                mu = mean - 0.57721 * belta
+                self.method = "gumbel"
+                self.params = (mu, belta)
             else:
-                intensity.append(np.random.choice(p))
-        self.intensity_sample = intensity
-        return self.intensity_sample
+                raise LookupError(f"Method {p[0]} does not supported!")
+        else:
+            self.method = "choice"
+            self.params = (np.array(p),)
+
+    def sample(self, rng, n):
+        """从 rng (np.random 或 numpy.random.Generator) 中采样 n 个功率"""
+        if self.method == "choice":
+            values = rng.choice(self.params[0], size=n)
+        else:
+            values = getattr(rng, self.method)(*self.params, size=n)
+        return np.asarray(values, dtype=np.float64)
+
+    def ppf(self, u):
+        """将 [0, 1) 上的均匀点映射为功率 (边缘分布的逆累积分布函数)"""
+        u = np.clip(u, np.finfo(np.float64).tiny, 1 - np.finfo(np.float64).eps)
+        if self.method == "choice":
+            values = self.params[0]
+            return values[np.minimum((u * values.size).astype(np.int64), values.size - 1)].astype(np.float64)
+        elif self.method == "uniform":
+            low, high = self.params
+            return low + u * (high - low)
+        elif self.method == "normal":
+            return stats.norm.ppf(u, loc=self.params[0], scale=self.params[1])
+        elif self.method == "lognormal":
+            return stats.lognorm.ppf(u, self.params[1], scale=math.exp(self.params[0]))
+        else:
+            return stats.gumbel_r.ppf(u, loc=self.params[0], scale=self.params[1])
+
+
+class PowerDesign:
+    """所有组件联合的功率采样设计
+
+    Sobol and Halton points are scrambled with ``seed`` and sample ``i``
+    always takes point ``i`` of the sequence, so any index range can be
+    drawn by any worker and the union is still one low-discrepancy design.
+    A Latin hypercube is built for all ``sample_n`` samples at once and
+    sliced.
+
+    Args:
+        method (str): sobol, halton, lhs
+        d (int): 组件数量
+        sample_n (int): 样本总数 (lhs)
+        seed (int): 随机种子, 同一次运行的所有进程必须相同
+    """
+
+    def __init__(self, method, d, sample_n=None, seed=None):
+        if method not in ["sobol", "halton", "lhs"]:
+            raise LookupError(f"Power sampling {method} is not supported (random, sobol, halton, lhs)!")
+        if method == "lhs" and sample_n is None:
+            raise ValueError("Latin hypercube sampling needs the number of samples.")
+        self.method = method
+        self.d = d
+        self.sample_n = sample_n
+        self.seed = seed
+        self.engine = None
+        self.points = None
+
+    def uniforms(self, start, stop):
+        """样本 start, ..., stop - 1 对应的设计点, shape (stop - start, d)"""
+        if self.method == "lhs":
+            if self.points is None:
+                self.points = qmc.LatinHypercube(self.d, seed=self.seed).random(self.sample_n)
+            assert 0 <= start <= stop <= self.sample_n, "Sample index is out of the Latin hypercube design"
+            return self.points[start:stop]
+
+        if self.engine is None or self.engine.num_generated != start:
+            engine = qmc.Sobol if self.method == "sobol" else qmc.Halton
+            self.engine = engine(self.d, scramble=True, seed=self.seed)
+            if start > 0:
+                self.engine.fast_forward(start)
+        with warnings.catch_warnings():
+            # 各进程只取序列中的一段, 不要求 2 的幂
+            warnings.simplefilter("ignore", UserWarning)
+            return self.engine.random(stop - start)
 
 
 class FMatrix:
@@ -93,31 +218,37 @@ class FMatrix:
         self.sample_power = sample_power
         self.comgrid = None
         self.overlap = None
+        # effective intensity of each component, F = sum(weights[i] * F_i)
+        self.weights = None
 
-    def com2matrix(self):
-
-        self.comgrid = np.zeros((self.components.domain.grid,self.components.domain.grid))
-        self.overlap = np.zeros((self.components.domain.grid,self.components.domain.grid))
+    def com2matrix(self, rng=np.random):
 
-        special_zero = special_random_num(self.components.number, self.components.special_num, special=self.components.special)
-        constant_power = self.sample_power[0]
-
-        for num, size_i, int_i, angle_i, geo_i, pd_i, pos_i in zip(range(0,self.components.number), self.components.size, self.sample_power, self.components.angle, self.components.geometry, self.components.power_distribution, self.components.position):
-            # special heat source components
-            if self.components.special == "y" and self.components.special_num == self.components.number:
-                int_i = constant_power
-            elif num in special_zero:
-                continue
-            else:
-                pass
+        unit_comgrid, unit_overlap = self.unit2matrix()
 
-            comgrid, overlap = self.rotate2matrix(size_i, int_i, angle_i, geo_i, pd_i, pos_i)
+        weights, active = component_weights(np.array([self.sample_power], dtype=np.float64), self.components, rng)
+        self.weights = weights[0]
 
-            self.comgrid = self.comgrid + comgrid
-            self.overlap = self.overlap + overlap
+        self.comgrid = np.tensordot(self.weights, unit_comgrid, axes=1)
+        self.overlap = np.tensordot(active[0], unit_overlap, axes=1)
 
         return self.comgrid, self.overlap
 
+    def unit2matrix(self):
+        """各组件单位功率热源矩阵与覆盖掩码
+
+        Geometry, angle and position do not change within a run, so the
+        footprints are rasterized once and cached on the components.
+        """
+        if self.components.unit_comgrid is None:
+            comgrids, overlaps = [], []
+            for size_i, angle_i, geo_i, pd_i, pos_i in zip(self.components.size, self.components.angle, self.components.geometry, self.components.power_distribution, self.components.position):
+                comgrid, overlap = self.rotate2matrix(size_i, 1.0, angle_i, geo_i, pd_i, pos_i)
+                comgrids.append(comgrid)
+                overlaps.append(overlap)
+            self.components.unit_comgrid = np.stack(comgrids)
+            self.components.unit_overlap = np.stack(overlaps)
+        return self.components.unit_comgrid, self.components.unit_overlap
+
     def rotate2matrix(self, size, intensity, angle, geometry, power_distribution, position):
 
         if geometry == 'rectangle':
@@ -135,132 +266,153 @@ class FMatrix:
                                 overlap[self.components.domain.grid:-self.components.domain.grid,self.components.domain.grid:-self.components.domain.grid]
         else:
             comgrid, overlap = component_rotate(position, size, angle, self.components.domain.size, \
-                                                self.components.domain.grid, comgrid, overlap)
+                                                self.components.domain.grid, comgrid, overlap, mode=self.components.rotation)
         return comgrid, overlap
 
     def rectangle2matrix(self, size, intensity, angle, geometry, power_distribution, position):
-        comgrid = np.zeros((3*self.components.domain.grid,3*self.components.domain.grid))
-        overlap = np.zeros((3*self.components.domain.grid,3*self.components.domain.grid))
-
         lp = position - size/2
         rp = position + size/2
         if angle <= TOL:
             assert lp[0]>0 and lp[1]>0 and rp[0]<=self.components.domain.size and rp[1]<=self.components.domain.size
         else:
             assert max(lp[0],lp[1])>=0 and min(rp[0],rp[1])<=self.components.domain.size and min(lp[0],lp[1])>-self.components.domain.size and max(rp[0],rp[1])<=2*self.components.domain.size
-        lp_grid = np.round(lp/self.components.domain.size * self.components.domain.grid).astype(np.int64)
-        rp_grid = np.round(rp/self.components.domain.size * self.components.domain.grid).astype(np.int64)
 
         rn = pow((lp[0]-position[0]),2)+pow((lp[1]-position[1]),2)
 
-        for col in range(lp_grid[0],rp_grid[0]):
-            for row in range(lp_grid[1],rp_grid[1]):
-                overlap[row+self.components.domain.grid,col+self.components.domain.grid] += 1
-                if power_distribution == 'uniform':
-                    comgrid[row+self.components.domain.grid,col+self.components.domain.grid] = self.uniform2matrix(intensity)
-                elif power_distribution == 'gaussian':
-                    comgrid[row+self.components.domain.grid,col+self.components.domain.grid] = self.gaussian2matrix(row, col, position, intensity, rn, self.components.gaussian_param)
-                else:
-                    raise LookupError(f'Power distribution {power_distribution} is not supported (gaussian, uniform)!')
-        return comgrid, overlap
+        row, col, row_d, col_d = self.bbox2grid(lp, rp)
+        inside = np.ones((row.size, col.size), dtype=bool)
+        return self.mask2matrix(row, col, inside, position, intensity, rn, power_distribution)
 
     def circle2matrix(self, size, intensity, angle, geometry, power_distribution, position):
-        comgrid = np.zeros((3*self.components.domain.grid,3*self.components.domain.grid))
-        overlap = np.zeros((3*self.components.domain.grid,3*self.components.domain.grid))
-
         lp = position - size/2
         rp = position + size/2
         if angle <= TOL:
             assert lp[0]>0 and lp[1]>0 and rp[0]<=self.components.domain.size and rp[1]<=self.components.domain.size
         else:
             assert min(lp[0],lp[1])>=0 and max(rp[0],rp[1])<=self.components.domain.size and min(lp[0],lp[1])>-self.components.domain.size and max(rp[0],rp[1])<=2*self.components.domain.size
-        lp_grid = np.round(lp/self.components.domain.size * self.components.domain.grid).astype(np.int64)
-        rp_grid = np.round(rp/self.components.domain.size * self.components.domain.grid).astype(np.int64)
 
         rn = pow(size[0]/2,2) if size[0]>=size[1] else pow(size[1]/2,2)
 
-        for col in range(lp_grid[0],rp_grid[0]):
-            for row in range(lp_grid[1],rp_grid[1]):
-                dis = pow((col/self.components.domain.grid*self.components.domain.size-position[0]),2)/ pow(size[0]/2,2)+pow((row/self.components.domain.grid*self.components.domain.size-position[1]),2)/ pow(size[1]/2,2)
-                if dis < 1:
-                    overlap[row+self.components.domain.grid,col+self.components.domain.grid] += 1
-                    if power_distribution == 'uniform':
-                        comgrid[row+self.components.domain.grid,col+self.components.domain.grid] = self.uniform2matrix(intensity)
-                    elif power_distribution == 'gaussian':
-                        comgrid[row+self.components.domain.grid,col+self.components.domain.grid] = self.gaussian2matrix(row, col, position, intensity, rn, self.components.gaussian_param)
-                    else:
-                        raise LookupError(f'Power distribution {power_distribution} is not supported (gaussian, uniform)!')
-                else:
-                    pass
-        return comgrid, overlap
+        row, col, row_d, col_d = self.bbox2grid(lp, rp)
+        dis = np.square(col_d-position[0])/ pow(size[0]/2,2)+np.square(row_d-position[1])/ pow(size[1]/2,2)
+        return self.mask2matrix(row, col, dis < 1, position, intensity, rn, power_distribution)
 
     def capsule2matrix(self, size, intensity, angle, geometry, power_distribution, position):
-        comgrid = np.zeros((3*self.components.domain.grid,3*self.components.domain.grid))
-        overlap = np.zeros((3*self.components.domain.grid,3*self.components.domain.grid))
-
         lp = position - size/2
         rp = position + size/2
         if abs(angle) <= TOL:
             assert lp[0]>0 and lp[1]>0 and rp[0]<=self.components.domain.size and rp[1]<=self.components.domain.size
         else:
             assert min(lp[0],lp[1])>=0 and max(rp[0],rp[1])<=self.components.domain.size and min(lp[0],lp[1])>-self.components.domain.size and max(rp[0],rp[1])<=2*self.components.domain.size
-        lp_grid = np.round(lp/self.components.domain.size * self.components.domain.grid).astype(np.int64)
-        rp_grid = np.round(rp/self.components.domain.size * self.components.domain.grid).astype(np.int64)
 
         rn = pow(size[0]/2,2) if size[0]>=size[1] else pow(size[1]/2,2)
 
-        for col in range(lp_grid[0],rp_grid[0]):
-            for row in range(lp_grid[1],rp_grid[1]):
-                row_d = row/self.components.domain.grid*self.components.domain.size
-                col_d = col/self.components.domain.grid*self.components.domain.size
+        ll = (position[0] - (size[0]-size[1])/2, position[1]-size[1]/2) if size[0] > size[1] else (position[0] - (size[0])/2, position[1]-(size[1]-size[0])/2)
+        rr = (position[0] + (size[0]-size[1])/2, position[1]+size[1]/2) if size[0] > size[1] else (position[0] + (size[0])/2, position[1]+(size[1]-size[0])/2)
 
-                ll = (position[0] - (size[0]-size[1])/2, position[1]-size[1]/2) if size[0] > size[1] else (position[0] - (size[0])/2, position[1]-(size[1]-size[0])/2)
-                rr = (position[0] + (size[0]-size[1])/2, position[1]+size[1]/2) if size[0] > size[1] else (position[0] + (size[0])/2, position[1]+(size[1]-size[0])/2)
-                
-                lc = (position[0]-(size[0]-size[1])/2, position[1]) if size[0] > size[1] else (position[0], position[1]-(size[1]-size[0])/2)
-                rc = (position[0]+(size[0]-size[1])/2, position[1]) if size[0] > size[1] else (position[0], position[1]+(size[1]-size[0])/2)
-                dlc = pow((col/self.components.domain.grid*self.components.domain.size-lc[0]),2)+pow((row/self.components.domain.grid*self.components.domain.size-lc[1]),2)
-                drc = pow((col/self.components.domain.grid*self.components.domain.size-rc[0]),2)+pow((row/self.components.domain.grid*self.components.domain.size-rc[1]),2)
-                        
-                radius = size[0]/2 if size[0]<=size[1] else size[1]/2
-                        
-                if (ll[0] <= col_d and col_d <= rr[0] and ll[1] <= row_d and row_d <= rr[1]) or dlc <= pow(radius,2) or drc <= pow(radius,2):
-                    overlap[row+self.components.domain.grid,col+self.components.domain.grid] += 1
-                    if power_distribution == 'uniform':
-                        comgrid[row+self.components.domain.grid,col+self.components.domain.grid] = self.uniform2matrix(intensity)
-                    elif power_distribution == 'gaussian':
-                        comgrid[row+self.components.domain.grid,col+self.components.domain.grid] = self.gaussian2matrix(row, col, position, intensity, rn, self.components.gaussian_param)
-                    else:
-                        raise LookupError(f'Power distribution {power_distribution} is not supported (gaussian, uniform)!')
-                else:
-                    pass
+        lc = (position[0]-(size[0]-size[1])/2, position[1]) if size[0] > size[1] else (position[0], position[1]-(size[1]-size[0])/2)
+        rc = (position[0]+(size[0]-size[1])/2, position[1]) if size[0] > size[1] else (position[0], position[1]+(size[1]-size[0])/2)
+
+        radius = size[0]/2 if size[0]<=size[1] else size[1]/2
+
+        row, col, row_d, col_d = self.bbox2grid(lp, rp)
+        dlc = np.square(col_d-lc[0])+np.square(row_d-lc[1])
+        drc = np.square(col_d-rc[0])+np.square(row_d-rc[1])
+        inside = ((ll[0] <= col_d) & (col_d <= rr[0]) & (ll[1] <= row_d) & (row_d <= rr[1])) | (dlc <= pow(radius,2)) | (drc <= pow(radius,2))
+        return self.mask2matrix(row, col, inside, position, intensity, rn, power_distribution)
+
+    def bbox2grid(self, lp, rp):
+        """组件包围盒内的像素索引 (列向量 row, 行向量 col) 及其坐标"""
+        lp_grid = np.round(lp/self.components.domain.size * self.components.domain.grid).astype(np.int64)
+        rp_grid = np.round(rp/self.components.domain.size * self.components.domain.grid).astype(np.int64)
+
+        row = np.arange(lp_grid[1], rp_grid[1])[:, None]
+        col = np.arange(lp_grid[0], rp_grid[0])[None, :]
+        row_d = row/self.components.domain.grid*self.components.domain.size
+        col_d = col/self.components.domain.grid*self.components.domain.size
+        return row, col, row_d, col_d
+
+    def mask2matrix(self, row, col, inside, position, intensity, rn, power_distribution):
+        """将包围盒内的组件区域写入 3*grid x 3*grid 的扩展网格"""
+        grid = self.components.domain.grid
+        comgrid = np.zeros((3*grid,3*grid))
+        overlap = np.zeros((3*grid,3*grid))
+        if not inside.any():
+            return comgrid, overlap
+
+        if power_distribution == 'uniform':
+            value = self.uniform2matrix(intensity)
+        elif power_distribution == 'gaussian':
+            value = self.gaussian2matrix(row, col, position, intensity, rn, self.components.gaussian_param)
+        else:
+            raise LookupError(f'Power distribution {power_distribution} is not supported (gaussian, uniform)!')
+
+        box = (slice(row[0, 0]+grid, row[-1, 0]+grid+1), slice(col[0, 0]+grid, col[0, -1]+grid+1))
+        overlap[box] = inside
+        comgrid[box] = np.where(inside, value, 0)
         return comgrid, overlap
 
     def uniform2matrix(self, intensity):
         return intensity
 
     def gaussian2matrix(self, row, col, position, intensity, rn, gaussian_param):
-        point_dis = pow((col/self.components.domain.grid*self.components.domain.size-position[0]),2)+pow((row/self.components.domain.grid*self.components.domain.size-position[1]),2)
+        point_dis = np.square(col/self.components.domain.grid*self.components.domain.size-position[0])+np.square(row/self.components.domain.grid*self.components.domain.size-position[1])
         return intensity*np.exp(-gaussian_param*point_dis/rn)
 
 
+def sample_rng(seed, index):
+    """第 index 个样本的随机数生成器
+
+    The stream only depends on (seed, index); it is the index-th child of
+    ``SeedSequence(seed).spawn``, so any index range can be regenerated
+    bit-identically by any process.
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(index,)))
+
+
 # special components random selected
-def special_random_num(
+def special_zero_mask(
+    rng,
+    n: int,
     num: int,
     num_zero: int,
     special='n',
 ):
+    """特殊样本中功率置零的组件, 返回 shape (n, num) 的布尔矩阵
+
+    Each row zeroes ``num_zero`` components chosen uniformly at random
+    (the first ``num_zero`` entries of a random permutation).
+    """
+    mask = np.zeros((n, num), dtype=bool)
     if special == 'y':
-        s = [x for x in range(0,num)]
-        import random
-        random.shuffle(s)
         assert num_zero in range(0,num+1), "Wrong number of special heat sources"
         if num_zero==0 or num_zero==num:
-            return []
-        else:
-            return s[:num_zero]
+            return mask
+        order = np.argsort(rng.random((n, num)), axis=1)
+        np.put_along_axis(mask, order[:, :num_zero], True, axis=1)
+    return mask
+
+
+def component_weights(intensity, components: Components, rng=np.random):
+    """组件有效功率
+
+    Args:
+        intensity (ndarray): 采样功率, shape (n, number)
+
+    Returns:
+        weights (ndarray): 有效功率, 特殊组件置零; 全部为特殊组件时均取第一个组件的功率
+        active (ndarray): 参与叠加的组件 (0/1), shape (n, number)
+    """
+    weights = np.array(intensity, dtype=np.float64)
+    active = np.ones_like(weights)
+    # special heat source components
+    if components.special == "y" and components.special_num == components.number:
+        weights[:] = weights[:, :1]
     else:
-        return []
+        zero = special_zero_mask(rng, weights.shape[0], components.number, components.special_num, special=components.special)
+        weights[zero] = 0
+        active[zero] = 0
+    return weights, active
 
 
 # components rotate operation
@@ -271,8 +423,18 @@ def component_rotate(
     length, 
     grid,
     comgrid, 
-    overlap
+    overlap,
+    mode='nearest',
+    subdivision=4,
 ):
+    """旋转组件: 对旋转后的包围盒整体做逆映射, 从未旋转的组件矩阵中取值
+
+    Args:
+        mode (str): 'nearest' 取逆映射点所在像素的值 (与逐像素实现一致);
+            'area' 将每个像素划分为 subdivision x subdivision 个子像素,
+            取各子像素逆映射值的平均 (面积加权)
+        subdivision (int): 'area' 模式下每个方向的子像素数
+    """
     rotate_comgrid = np.zeros_like(comgrid)
     rotate_overlap = np.zeros_like(overlap)
 
@@ -284,24 +446,36 @@ def component_rotate(
     lp_grid = np.round(lp/length * grid).astype(np.int64)
     rp_grid = np.round(rp/length * grid).astype(np.int64)
 
-    for col in range(lp_grid[0], rp_grid[0]):
-        for row in range(lp_grid[1], rp_grid[1]):
-
-            poi = [col/grid*length, row/grid*length]
-            m = dis(poi, center)
-            pA = math.asin((poi[1]-center[1])/(m+TOL))
-            p0 = math.radians(180)
-            pr = math.radians(angle)
-            dy = m * math.sin(p0-pA-pr) if poi[0] < center[0] else m * math.sin(pA-pr)
-            dx = m * math.cos(p0-pA-pr) if poi[0] < center[0] else m * math.cos(pA-pr)
-            x = center[0] + dx
-            y = center[1] + dy
-            
-            if ((math.floor(x/length*grid)+grid) in range(lp_grid[0]+grid, rp_grid[0]+grid)) and ((math.floor(y/length*grid)+grid) in range(lp_grid[1]+grid, rp_grid[1]+grid)):
-                rotate_overlap[row+grid, col+grid] = overlap[math.floor(y/length*grid)+grid, math.floor(x/length*grid)+grid]
-                rotate_comgrid[row+grid, col+grid] = comgrid[math.floor(y/length*grid)+grid, math.floor(x/length*grid)+grid]
-            else:
-                pass
+    col = np.arange(lp_grid[0], rp_grid[0])[None, :]
+    row = np.arange(lp_grid[1], rp_grid[1])[:, None]
+    if col.size == 0 or row.size == 0:
+        return rotate_comgrid[grid:-grid,grid:-grid], rotate_overlap[grid:-grid,grid:-grid]
+
+    if mode == 'nearest':
+        offsets = np.zeros(1)
+    elif mode == 'area':
+        offsets = (np.arange(subdivision) + 0.5) / subdivision - 0.5
+    else:
+        raise LookupError(f'Rotation mode {mode} is not supported (nearest, area)!')
+
+    box_comgrid = np.zeros((row.size, col.size))
+    box_overlap = np.zeros((row.size, col.size))
+    for oy in offsets:
+        for ox in offsets:
+            ix, iy = inverse_rotate((col + ox)/grid*length, (row + oy)/grid*length, center, angle, length, grid)
+            inside = (ix >= lp_grid[0]+grid) & (ix < rp_grid[0]+grid) & (iy >= lp_grid[1]+grid) & (iy < rp_grid[1]+grid)
+            ix = np.where(inside, ix, 0)
+            iy = np.where(inside, iy, 0)
+            box_comgrid += np.where(inside, comgrid[iy, ix], 0)
+            box_overlap += np.where(inside, overlap[iy, ix], 0)
+    if offsets.size > 1:
+        box_comgrid /= offsets.size ** 2
+        box_overlap /= offsets.size ** 2
+
+    box = (slice(row[0, 0]+grid, row[-1, 0]+grid+1), slice(col[0, 0]+grid, col[0, -1]+grid+1))
+    rotate_comgrid[box] = box_comgrid
+    rotate_overlap[box] = box_overlap
+
     if lp_grid.all() in range(0,grid) and rp_grid.all() in range(0,grid):
         pass
     else:
@@ -319,8 +493,20 @@ def component_rotate(
     return rotate_comgrid[grid:-grid,grid:-grid], rotate_overlap[grid:-grid,grid:-grid]
 
 
-def dis(point, center):
-    return np.linalg.norm(np.array(point-center))
+def inverse_rotate(x, y, center, angle, length, grid):
+    """将旋转后的坐标 (x, y) 逆旋转回组件坐标系, 返回所在像素在扩展网格中的索引"""
+    dx = x - center[0]
+    dy = y - center[1]
+    m = np.sqrt(dx*dx + dy*dy)
+    pA = np.arcsin(dy/(m+TOL))
+    p0 = math.radians(180)
+    pr = math.radians(angle)
+    phase = np.where(x < center[0], p0-pA-pr, pA-pr)
+    x = center[0] + m * np.cos(phase)
+    y = center[1] + m * np.sin(phase)
+    ix = np.floor(x/length*grid).astype(np.int64) + grid
+    iy = np.floor(y/length*grid).astype(np.int64) + grid
+    return ix, iy
 
 
 def get_task_powers_sampling(
@@ -338,6 +524,10 @@ def get_task_powers_sampling(
     gaussian_param=1,
     rad=True,
     method: str = "random",
+    rotation: str = "nearest",
+    power_sampling: str = "random",
+    sample_n=None,
+    seed=None,
 ) -> Task:
     """构造布局任务
 
@@ -352,6 +542,10 @@ def get_task_powers_sampling(
         position (Sequence, optional): [description].
         rad (bool, optional): [description]. Defaults to True.
         method (str, optional): [description]. Defaults to "random".
+        rotation (str, optional): 旋转组件的栅格化方式 (nearest, area). Defaults to "nearest".
+        power_sampling (str, optional): 功率采样方式 (random, sobol, halton, lhs). Defaults to "random".
+        sample_n (int, optional): 样本总数, lhs 需要.
+        seed (int, optional): 联合采样设计的随机种子.
 
     Returns:
         Task: [description]
@@ -359,10 +553,11 @@ def get_task_powers_sampling(
 
     domain = Domain(geometry_board, size_board, grid_board)
     components = Components(
-        domain, geometry, size, angle, intensity, power_distribution, position, special_num=special_num, special=special
+        domain, geometry, size, angle, intensity, power_distribution, position, special_num=special_num, special=special, rotation=rotation
     )
     if method == "random":
-        return TaskPowersSampling(components)
+        design = None if power_sampling == "random" else PowerDesign(power_sampling, components.number, sample_n, seed)
+        return TaskPowersSampling(components, design=design)
     elif method is None:
         return Task(components)
     else:
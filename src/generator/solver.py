@@ -9,6 +9,8 @@ Desc      :   solver for TFR-HSS task.
 
 
 import numpy as np
+import scipy.sparse as sp
+from scipy.spatial import cKDTree
 
 import fenics as fs
 from src.generator.boundary import AllBoundary
@@ -57,6 +59,83 @@ class Source(fs.UserExpression):
         return ()
 
 
+class GridSource:
+    """热源矩阵 F 到有限元函数的向量化映射
+
+    ``Source`` is a degree 2 ``UserExpression``, so assembling with it
+    interpolates ``get_source`` into P2 on every cell. Here the same P2
+    interpolant is built directly: each DOF takes the pixel
+    ``F[int(y / length * (n - 1)), int(x / length * (n - 1))]``, with the
+    index arrays computed once from the DOF coordinates.
+
+    Args:
+        mesh (Mesh): 网格
+        length (float): 板边长
+        degree (int): 插值次数, 与 Source 保持一致
+    """
+
+    def __init__(self, mesh, length, degree=2):
+        self.length = length
+        self.V = fs.FunctionSpace(mesh, 'P', degree)
+        self.function = fs.Function(self.V)
+        gdim = mesh.geometry().dim()
+        self.coordinates = self.V.tabulate_dof_coordinates().reshape(-1, gdim)
+        self.n = None
+        self.index = None
+
+    def update(self, F):
+        n = F.shape[0]
+        if n != self.n:
+            # int() 截断, 与 Source.get_source 一致; 索引顺序为 (zz,) yy, xx
+            index = (self.coordinates / self.length * (n - 1)).astype(np.int64)
+            self.index = tuple(index[:, ::-1].T)
+            self.n = n
+        values = self.function.vector()
+        values.set_local(np.ascontiguousarray(F[self.index], dtype=np.float64))
+        values.apply('insert')
+        return self.function
+
+
+class ProjectedSource:
+    """热源矩阵 F 在非均匀网格上的逐单元 L2 投影
+
+    On a coarse or adaptive mesh a cell spans many pixels, and sampling F at
+    the DOFs like ``GridSource`` aliases components narrower than a cell:
+    they are missed or over-weighted depending on where the DOFs fall. Here
+    the pixel field is projected cell by cell onto discontinuous linear
+    functions (DG1) with ``pixel_projection``, which keeps the heat of every
+    pixel. The projection matrix is built once per resolution of F.
+
+    Args:
+        mesh (Mesh): 网格
+        length (float): 板边长
+    """
+
+    def __init__(self, mesh, length):
+        self.length = length
+        self.V = fs.FunctionSpace(mesh, 'DG', 1)
+        self.function = fs.Function(self.V)
+        gdim = mesh.geometry().dim()
+        self.vertices = mesh.coordinates()[mesh.cells()]
+        dofmap = self.V.dofmap()
+        cell_dofs = np.array([dofmap.cell_dofs(c) for c in range(mesh.num_cells())])
+        self.points = self.V.tabulate_dof_coordinates().reshape(-1, gdim)[cell_dofs]
+        # 投影矩阵的行按单元排列, 换成自由度顺序
+        self.order = np.argsort(cell_dofs.ravel())
+        self.n = None
+        self.projection = None
+
+    def update(self, F):
+        n = F.shape[0]
+        if n != self.n:
+            self.projection = pixel_projection(self.vertices, self.points, self.length, n)[self.order]
+            self.n = n
+        values = self.function.vector()
+        values.set_local(self.projection @ np.asarray(F, dtype=np.float64).ravel())
+        values.apply('insert')
+        return self.function
+
+
 def get_mesh(length, nx, ny, nz=None):
     """generate mesh: support rectangle, Box (not supported)
 
@@ -91,33 +170,305 @@ def get_mesh_grid(length, nx, ny, nz=None):
     return xs, ys, zs
 
 
-def solver(f, length, bds, u_D, Nx, Ny, degree=1):
+class PoissonSolver:
+    """Reusable solver for -Laplace(u) = f with fixed mesh and boundaries.
+
+    The mesh, the function space, the Dirichlet boundaries and the stiffness
+    matrix (with the boundaries applied) are built once, so each new source
+    only costs a load vector assembly and a linear solve.
+
+    With ``linear_solver="lu"`` the factorization is computed on the first
+    solve and reused. ``"cg"`` uses a preconditioned conjugate gradient
+    (the boundaries are applied symmetrically, so the matrix stays SPD),
+    which needs far less memory on fine and 3d meshes and agrees with LU up
+    to the solver tolerance. Every solve starts from zero, so a sample does
+    not depend on what the process solved before; ``warm_start`` starts from
+    the previous solution instead, which saves iterations but makes the
+    result depend on the order of the samples (not reproducible bit for
+    bit across worker counts or resumed runs).
+
+    Args:
+        degree (int): 有限元次数
+        linear_solver (str): lu or cg
+        preconditioner (str): cg 的预条件, 如 amg, hypre_amg, petsc_amg, ilu, jacobi
+        rtol (float): cg 相对残差
+        atol (float): cg 绝对残差
+        max_iter (int): cg 最大迭代次数
+        warm_start (bool): cg 以上一个样本的解为初值
+        mesh (Mesh): 求解网格, 默认为 Nx 均匀网格; 给定时热源逐单元投影 (ProjectedSource), 解插值到 Nx 均匀网格
     """
-    Solve -Laplace(u) = f on [0,1] x [0,1] with 2*Nx*Ny Lagrange
-    elements of specified degree and u = u_D (Expresssion) on
-    the boundary.
+
+    def __init__(
+        self,
+        length,
+        bds,
+        u_D,
+        Nx,
+        Ny,
+        Nz=None,
+        degree=1,
+        linear_solver="lu",
+        preconditioner="amg",
+        rtol=1e-10,
+        atol=1e-12,
+        max_iter=1000,
+        warm_start=False,
+        mesh=None,
+    ):
+        self.length = length
+        self.mesh = get_mesh(length, Nx, Ny, Nz) if mesh is None else mesh
+        self.V = fs.FunctionSpace(self.mesh, 'P', degree)
+        # 其他网格上的解插值到均匀输出网格; 同一网格上的高阶解可直接取顶点值
+        self.sampler = None if mesh is None else GridSampler(self.V, length, Nx, Ny, Nz)
+
+        if bds:
+            self.bcs = AllBoundary(self.V, bds, u_D).get_boundary()
+        else:
+            raise ValueError('Boundary conditions empty!')
+
+        if mesh is None:
+            # 热源插值次数不低于解的次数
+            self.f = GridSource(self.mesh, length, degree=max(2, degree))
+        else:
+            # 单元跨越多个像素, 逐单元投影以免窄组件被漏采
+            self.f = ProjectedSource(self.mesh, length)
+
+        u = fs.TrialFunction(self.V)
+        v = fs.TestFunction(self.V)
+        a = fs.dot(fs.grad(u), fs.grad(v))*fs.dx
+        L = self.f.function*v*fs.dx
+
+        # 对称施加边界条件，矩阵只组装一次
+        self.assembler = fs.SystemAssembler(a, L, self.bcs)
+        self.A = fs.PETScMatrix()
+        self.assembler.assemble(self.A)
+        self.b = fs.PETScVector()
+        self.linear_solver = get_linear_solver(
+            self.A, linear_solver, preconditioner, rtol, atol, max_iter, warm_start
+        )
+        self.u = fs.Function(self.V)
+        self.iterations = 0
+
+    def solve(self, F):
+        """Solve with heat source matrix F, the returned Function is reused."""
+        self.f.update(F)
+        self.assembler.assemble(self.b)
+        self.iterations = self.linear_solver.solve(self.u.vector(), self.b)
+        return self.u
+
+    def vertex_values(self):
+        """最近一次求解在 (nx + 1) 均匀网格顶点上的值"""
+        if self.sampler is None:
+            return self.u.compute_vertex_values()
+        return self.sampler(self.u)
+
+
+class GridSampler:
+    """有限元函数到均匀网格顶点值的插值
+
+    The transfer matrix from ``V`` (any mesh, any degree) to P1 on the
+    uniform mesh of ``get_mesh`` evaluates the basis functions of ``V`` at
+    the output vertices. It is built once, so sampling a solution is one
+    sparse product instead of a point evaluation per vertex.
     """
 
-    # Create mesh and define function space
-    mesh = get_mesh(length, Nx, Ny)
-    V = fs.FunctionSpace(mesh, 'P', degree)
+    def __init__(self, V, length, Nx, Ny, Nz=None):
+        self.V_out = fs.FunctionSpace(get_mesh(length, Nx, Ny, Nz), 'P', 1)
+        self.transfer = fs.PETScDMCollection.create_transfer_matrix(V, self.V_out)
+        self.u_out = fs.Function(self.V_out)
 
-    if bds:
-        bcs = AllBoundary(V, bds, u_D).get_boundary()  
-    else:
-        ValueError('Boundary conditions empty!')
+    def __call__(self, u):
+        self.transfer.mult(u.vector(), self.u_out.vector())
+        return self.u_out.compute_vertex_values()
 
-    # Define variational problem
-    u = fs.TrialFunction(V)
-    v = fs.TestFunction(V)
-    F = fs.dot(fs.grad(u), fs.grad(v))*fs.dx - f*v*fs.dx
-    a = fs.lhs(F)
-    L = fs.rhs(F)
 
-    # Compute solution
-    u = fs.Function(V)
-    fs.solve(a == L, u, bcs)
-    return u
+def get_adaptive_mesh(length, bds, footprint, base=50, levels=2, band=2.0):
+    """在组件边缘与 Dirichlet 边界附近逐层加密的网格
+
+    Starts from a uniform ``base`` x ``base`` mesh and refines, ``levels``
+    times, the cells whose midpoint is within ``band`` current cell sizes of
+    a footprint edge or a Dirichlet segment, where the gradients of the
+    temperature field concentrate.
+
+    Args:
+        footprint (ndarray): 组件覆盖的网格, shape (n, n), 与 F 的索引一致
+    """
+    points = [footprint_edges(footprint, length)]
+    h_min = length / base / 2 ** levels
+    for bd in bds:
+        (lx, ly), (rx, ry) = bd[1]
+        k = int(max(abs(rx - lx), abs(ry - ly)) / h_min) + 2
+        points.append(np.stack([np.linspace(lx, rx, k), np.linspace(ly, ry, k)], axis=1))
+    tree = cKDTree(np.concatenate(points))
+
+    mesh = get_mesh(length, base, base)
+    for level in range(levels):
+        h = length / base / 2 ** level
+        midpoints = mesh.coordinates()[mesh.cells()].mean(axis=1)
+        distance, _ = tree.query(midpoints)
+        markers = fs.MeshFunction("bool", mesh, mesh.topology().dim(), False)
+        markers.array()[:] = distance < band * h
+        mesh = fs.refine(mesh, markers)
+    return mesh
+
+
+def footprint_edges(footprint, length):
+    """组件覆盖区域边缘像素的坐标 (x, y)"""
+    footprint = np.asarray(footprint, dtype=bool)
+    edge = np.zeros_like(footprint)
+    edge[:-1] |= footprint[:-1] != footprint[1:]
+    edge[1:] |= footprint[:-1] != footprint[1:]
+    edge[:, :-1] |= footprint[:, :-1] != footprint[:, 1:]
+    edge[:, 1:] |= footprint[:, :-1] != footprint[:, 1:]
+    yy, xx = np.nonzero(edge)
+    # F[int(y / length * (n - 1)), int(x / length * (n - 1))]
+    scale = length / (footprint.shape[0] - 1)
+    return np.stack([xx * scale, yy * scale], axis=1)
+
+
+def simplex_lattice(d, m):
+    """参考单纯形内的均匀点阵, 返回重心坐标, shape (points, d + 1)"""
+    axes = np.meshgrid(*[(np.arange(m) + 0.5) / m] * d, indexing="ij")
+    x = np.stack([a.ravel() for a in axes], axis=1)
+    x = x[x.sum(axis=1) < 1]
+    return np.concatenate([1 - x.sum(axis=1, keepdims=True), x], axis=1)
+
+
+def pixel_projection(vertices, points, length, n, chunk=2 ** 21):
+    """像素热源到各单元线性函数 (DG1) 的 L2 投影矩阵
+
+    F is taken as constant on each pixel, with the pixel of a point chosen
+    like ``Source.get_source``. Each cell is covered by a lattice of equally
+    weighted points at least two per pixel width, and the least squares fit
+    of a linear function to the pixel values at the points is evaluated at
+    the cell's DOFs.
+
+    Args:
+        vertices (ndarray): 单元顶点坐标, shape (cells, d + 1, d)
+        points (ndarray): 单元自由度坐标, shape (cells, d + 1, d)
+        length (float): 板边长
+        n (int): 热源矩阵每个方向的像素数
+
+    Returns:
+        csr_matrix: shape (cells * (d + 1), n ** d), 由 F.ravel() 得到自由度值
+    """
+    cells, k, d = vertices.shape
+    origin = vertices[:, 0]
+    edges = vertices[:, 1:] - origin[:, None]
+    # 自由度的重心坐标
+    mu = np.linalg.solve(
+        np.transpose(edges, (0, 2, 1))[:, None], (points - origin[:, None])[..., None]
+    )[..., 0]
+    mu = np.concatenate([1 - mu.sum(axis=2, keepdims=True), mu], axis=2)
+    diameter = np.linalg.norm(vertices[:, :, None] - vertices[:, None], axis=3).max(axis=(1, 2))
+    m = np.maximum(4, np.ceil(2 * diameter / (length / (n - 1)))).astype(np.int64)
+
+    blocks, rows = [], []
+    for size in np.unique(m):
+        lam = simplex_lattice(d, size)
+        # 最小二乘拟合: 系数 = G^-1 lam^T f / q, 对所有单元相同
+        weights = np.linalg.solve(lam.T @ lam, lam.T)
+        group = np.flatnonzero(m == size)
+        step = max(1, chunk // (lam.shape[0] * k))
+        for start in range(0, group.size, step):
+            c = group[start:start + step]
+            x = origin[c, None] + lam[None, :, 1:] @ edges[c]
+            index = np.clip((x / length * (n - 1)).astype(np.int64), 0, n - 1)
+            pixels = np.ravel_multi_index(tuple(index[..., ::-1].transpose(2, 0, 1)), (n,) * d)
+            data = mu[c] @ weights
+            block = sp.csr_matrix(
+                (
+                    data.ravel(),
+                    (np.repeat(np.arange(c.size * k), lam.shape[0]), np.repeat(pixels, k, axis=0).ravel()),
+                ),
+                shape=(c.size * k, n ** d),
+            )
+            blocks.append(block)
+            rows.append((c[:, None] * k + np.arange(k)).ravel())
+    order = np.argsort(np.concatenate(rows))
+    return sp.vstack(blocks, format="csr")[order]
+
+
+def get_linear_solver(
+    A, method="lu", preconditioner="amg", rtol=1e-10, atol=1e-12, max_iter=1000, warm_start=False
+):
+    """构造线性求解器: 直接法 LU 或预条件共轭梯度法"""
+    if method == "lu":
+        return fs.LUSolver(A)
+    if method == "cg":
+        if not fs.has_krylov_solver_preconditioner(preconditioner):
+            raise LookupError(f"Preconditioner {preconditioner} is not supported!")
+        linear_solver = fs.PETScKrylovSolver("cg", preconditioner)
+        linear_solver.set_operator(A)
+        prm = linear_solver.parameters
+        prm["relative_tolerance"] = rtol
+        prm["absolute_tolerance"] = atol
+        prm["maximum_iterations"] = max_iter
+        # 默认从零初值开始, 结果与样本的求解顺序无关
+        prm["nonzero_initial_guess"] = warm_start
+        return linear_solver
+    raise LookupError(f"Linear solver {method} is not supported!")
+
+
+def solver_params(options):
+    """从生成参数中取出有限元次数、线性求解器与网格参数"""
+    return dict(
+        degree=options.fem_degree or 1,
+        linear_solver=options.linear_solver,
+        preconditioner=options.preconditioner,
+        rtol=options.rtol,
+        atol=options.atol,
+        max_iter=options.max_iter,
+        warm_start=options.warm_start,
+        mesh=options.mesh,
+        mesh_base=options.mesh_base,
+        mesh_levels=options.mesh_levels,
+    )
+
+
+# 每个进程各自缓存的求解器
+_solvers = {}
+
+
+def get_solver(
+    length,
+    bds,
+    u_D,
+    Nx,
+    Ny,
+    Nz=None,
+    degree=1,
+    mesh="uniform",
+    mesh_base=50,
+    mesh_levels=2,
+    footprint=None,
+    **params,
+):
+    """Return the cached PoissonSolver of the current process.
+
+    With ``mesh="adaptive"`` the solver works on ``get_adaptive_mesh`` of
+    the component ``footprint``, with ``mesh="coarse"`` on a uniform
+    ``mesh_base`` mesh (meant for degree 2 or 3). Both return values on the
+    uniform ``Nx`` grid.
+    """
+    key = (length, repr(bds), u_D, Nx, Ny, Nz, degree, tuple(sorted(params.items())))
+    if mesh == "coarse":
+        key += (mesh, mesh_base)
+    elif mesh == "adaptive":
+        if Nz is not None:
+            raise ValueError("Adaptive mesh only supports 2d!")
+        if footprint is None:
+            raise ValueError("Adaptive mesh needs the component footprint!")
+        key += (mesh_base, mesh_levels, np.packbits(footprint).tobytes())
+    elif mesh != "uniform":
+        raise LookupError(f"Mesh {mesh} is not supported (uniform, coarse, adaptive)!")
+    if key not in _solvers:
+        if mesh == "coarse":
+            params["mesh"] = get_mesh(length, mesh_base, mesh_base, None if Nz is None else mesh_base)
+        elif mesh == "adaptive":
+            params["mesh"] = get_adaptive_mesh(length, bds, footprint, mesh_base, mesh_levels)
+        _solvers[key] = PoissonSolver(length, bds, u_D, Nx, Ny, Nz, degree=degree, **params)
+    return _solvers[key]
 
 
 def run_solver(
@@ -131,15 +482,20 @@ def run_solver(
     coordinates=False,
     is_plot=False,
     vtk=False,
+    **params,
 ):
-    "Run solver to compute and post-process solution"
+    """Run solver to compute and post-process solution
+
+    ``params`` are passed to get_solver (degree, linear solver and mesh
+    settings).
+    """
 
     ny = nx
     nz = nx if ndim == 3 else None
 
     # Set up problem parameters and call solver
-    f = Source(F, length)
-    u = solver(f, length, bcs, u0, nx, ny, degree=1)
+    solver = get_solver(length, bcs, u0, nx, ny, nz, **params)
+    u = solver.solve(F)
 
     if is_plot:
         import matplotlib.pyplot as plt
@@ -149,9 +505,9 @@ def run_solver(
         vtkfile = fs.File("solution.pvd")
         vtkfile << u
     if ndim == 2:
-        U = u.compute_vertex_values().reshape(nx + 1, nx + 1)
+        U = solver.vertex_values().reshape(nx + 1, nx + 1)
     else:
-        U = u.compute_vertex_values().reshape(nx + 1, nx + 1, nx + 1)
+        U = solver.vertex_values().reshape(nx + 1, nx + 1, nx + 1)
     
     if coordinates:
         xs, ys, zs = get_mesh_grid(length, nx, ny, nz)
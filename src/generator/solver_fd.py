@@ -0,0 +1,590 @@
+# -*- encoding: utf-8 -*-
+"""
+Desc      :   Finite difference solvers without fenics.
+"""
+# File    :   solver_fd.py
+
+import time
+from functools import reduce
+import numpy as np
+import scipy.sparse as sp
+from scipy.fft import dct, idct, dst, idst
+from scipy.linalg import lu_factor, lu_solve
+from scipy.sparse.linalg import splu
+
+
+TOL = 1e-10
+
+
+class VertexGridSolver:
+    """有限差分求解器的公共部分: 热源矩阵在网格顶点上的取值
+
+    Subclasses set ``coordinates`` (vertex coordinates in fenics order) and
+    ``length``.
+    """
+
+    _n = None
+    _index = None
+
+    def _source_values(self, F):
+        """F 在各顶点上的值 (flat), 与 solver.GridSource 的取值方式相同"""
+        n = F.shape[0]
+        if n != self._n:
+            index = (self.coordinates / self.length * (n - 1)).astype(np.int64)
+            self._index = tuple(index[:, ::-1].T)
+            self._n = n
+        return np.asarray(F[self._index], dtype=np.float64)
+
+
+class FDSolver(VertexGridSolver):
+    """-Laplace(u) = f on the vertex grid of ``solver.get_mesh``
+
+    The unknowns are the ``nx + 1`` grid vertices in fenics vertex order
+    (x fastest). The operator is the 5-point (7-point in 3d) Laplacian in
+    finite volume form: the Neumann condition is built into the half
+    control volumes on the boundary, which on the 2d right-triangle mesh
+    makes it exactly the P1 stiffness matrix fenics assembles. The source
+    is lumped to the vertices, so results agree with fenics up to the
+    quadrature of f. The Dirichlet segments are taken from ``bds`` like
+    ``AllBoundary`` does, and the reduced matrix is factorized once.
+
+    Args:
+        length (float): 板边长
+        bds (list): Dirichlet 边界
+        u_D (float): 边界默认温度
+        Nx, Ny, Nz (int): 各方向单元数, Nz 为 None 时为 2d
+    """
+
+    def __init__(self, length, bds, u_D, Nx, Ny, Nz=None):
+        if not bds:
+            raise ValueError('Boundary conditions empty!')
+        self.length = length
+        # 顶点数组按 (z,) y, x 排列, 展平后与 fenics 顶点顺序一致
+        self.shape = (Ny + 1, Nx + 1) if Nz is None else (Nz + 1, Ny + 1, Nx + 1)
+        self.coordinates = grid_coordinates(length, self.shape)
+        self.K, self.volume = laplacian(self.shape, length)
+
+        values = dirichlet_values(bds, u_D, self.coordinates, length)
+        self.fixed = ~np.isnan(values)
+        self.free = ~self.fixed
+        self.u_fixed = values[self.fixed]
+        K_free = self.K[self.free]
+        self.lu = splu(K_free[:, self.free].tocsc(), permc_spec="MMD_AT_PLUS_A")
+        self.b_fixed = K_free[:, self.fixed] @ self.u_fixed
+
+    def solve(self, F):
+        """Solve with heat source matrix F, returns vertex values (flat)."""
+        b = self.volume * self._source_values(F)
+        u = np.empty(self.volume.size)
+        u[self.fixed] = self.u_fixed
+        u[self.free] = self.lu.solve(b[self.free] - self.b_fixed)
+        return u
+
+
+class SpectralSolver(VertexGridSolver):
+    """Solves the same discrete problem as FDSolver with fast sine/cosine transforms
+
+    The finite volume operator factors as ``K = W L`` with ``W`` the
+    control volumes and ``L`` the Laplacian with ghost nodes, which is
+    separable. Along each axis a side that is entirely Dirichlet is taken
+    into the base operator and the other sides are Neumann, so ``L``
+    restricted to the remaining vertices is diagonalized by DCT-I (Neumann
+    at both ends), DST-I (Dirichlet at both ends) or DST-II/III (mixed).
+
+    Dirichlet vertices not covered by the base (partial sinks) are handled
+    with a capacitance matrix: ``L u = f + P sigma`` with unknown reactions
+    ``sigma`` on those vertices and ``P^T L^-1 P sigma = g - P^T L^-1 f``.
+    Without a Dirichlet side ``L`` is singular and the system is bordered
+    with the compatibility condition ``W_D sigma = -W f`` and a constant
+    ``c``. The small matrix is built once from k transform solves and LU
+    factorized; a sample then costs two transform solves plus a
+    back-substitution, or one transform solve when the base covers all
+    Dirichlet vertices. The second transform solve takes most of the gain
+    over FDSolver's reused LU: at 512 x 512 a sample is 2-3x faster with
+    a whole Dirichlet side, but only about 1.3x faster with a partial
+    sink on an otherwise Neumann board.
+
+    Args:
+        length (float): 板边长
+        bds (list): Dirichlet 边界
+        u_D (float): 边界默认温度
+        Nx, Ny, Nz (int): 各方向单元数, Nz 为 None 时为 2d
+        batch (int): 构造电容矩阵时每批求解的单位源数
+    """
+
+    def __init__(self, length, bds, u_D, Nx, Ny, Nz=None, batch=64):
+        if not bds:
+            raise ValueError('Boundary conditions empty!')
+        self.length = length
+        self.shape = (Ny + 1, Nx + 1) if Nz is None else (Nz + 1, Ny + 1, Nx + 1)
+        self.coordinates = grid_coordinates(length, self.shape)
+        K, self.volume = laplacian(self.shape, length)
+        values = dirichlet_values(bds, u_D, self.coordinates, length)
+        fixed = ~np.isnan(values).reshape(self.shape)
+
+        # 每个方向两端是否整条为 Dirichlet 边界, 决定变换类型与求解的顶点范围
+        self.kinds, region, eigenvalues = [], [], []
+        for axis, n in enumerate(self.shape):
+            lower = np.take(fixed, 0, axis=axis).all()
+            upper = np.take(fixed, n - 1, axis=axis).all()
+            kind = ("D" if lower else "N") + ("D" if upper else "N")
+            self.kinds.append(kind)
+            region.append(slice(int(lower), n - int(upper)))
+            eigenvalues.append(axis_eigenvalues(kind, n) / (length / (n - 1)) ** 2)
+        self.region = tuple(region)
+        lam = reduce(np.add.outer, eigenvalues)
+        self.singular = all(kind == "NN" for kind in self.kinds)
+        self.inv_lam = np.zeros_like(lam)
+        self.inv_lam[lam > 0] = 1 / lam[lam > 0]
+
+        index = np.arange(self.volume.size).reshape(self.shape)
+        inner = np.zeros(self.shape, dtype=bool)
+        inner[self.region] = True
+        self.inner = index[self.region].ravel()
+        self.base = index[~inner]
+        self.u_base = values[self.base]
+        # 基底中的 Dirichlet 值移到右端项
+        self.lift = -(K[self.inner][:, self.base] @ self.u_base) / self.volume[self.inner]
+
+        # 基底之外的 Dirichlet 顶点 (在求解区域内的编号)
+        self.fixed = np.flatnonzero(fixed[self.region])
+        self.u_fixed = values[self.inner[self.fixed]]
+        k = self.fixed.size
+        border = 1 if self.singular else 0
+        capacitance = np.zeros((k + border, k + border))
+        for start in range(0, k, batch):
+            nodes = self.fixed[start:start + batch]
+            e = np.zeros((nodes.size, self.inner.size))
+            e[np.arange(nodes.size), nodes] = 1
+            response = self.inverse(e.reshape((nodes.size,) + lam.shape))
+            capacitance[:k, start:start + nodes.size] = response.reshape(nodes.size, -1)[:, self.fixed].T
+        if self.singular:
+            capacitance[:k, k] = 1
+            capacitance[k, :k] = self.volume[self.inner[self.fixed]]
+        self.capacitance = lu_factor(capacitance) if capacitance.size else None
+
+    def inverse(self, f):
+        """L^-1 f on the solving region (L^+ if singular), 对最后 ndim 个维度变换"""
+        ndim = len(self.kinds)
+        for axis, kind in zip(range(-ndim, 0), self.kinds):
+            f = axis_transform(f, kind, axis, forward=True)
+        f = f * self.inv_lam
+        for axis, kind in zip(range(-ndim, 0), self.kinds):
+            f = axis_transform(f, kind, axis, forward=False)
+        return f
+
+    def solve(self, F):
+        """Solve with heat source matrix F, returns vertex values (flat)."""
+        f = self._source_values(F)[self.inner] + self.lift
+        shape = self.inv_lam.shape
+        v = self.inverse(f.reshape(shape)).ravel()
+        if self.capacitance is not None:
+            rhs = self.u_fixed - v[self.fixed]
+            if self.singular:
+                rhs = np.append(rhs, -self.volume[self.inner] @ f)
+            x = lu_solve(self.capacitance, rhs)
+            reaction = np.zeros_like(f)
+            reaction[self.fixed] = x[:self.fixed.size]
+            v += self.inverse(reaction.reshape(shape)).ravel()
+            if self.singular:
+                v += x[-1]
+            v[self.fixed] = self.u_fixed
+
+        u = np.empty(self.volume.size)
+        u[self.base] = self.u_base
+        u[self.inner] = v
+        return u
+
+
+class MultigridSolver(VertexGridSolver):
+    """Solves the same discrete problem as FDSolver with multigrid-preconditioned CG
+
+    Matrix-free: the operator and the damped Jacobi smoother are NumPy
+    slicing on the vertex grid and the grid transfers are sparse 1d
+    matrices applied along each axis, so memory is linear in the number of
+    vertices. Each coarse grid has ``ceil(cells / 2)`` cells per direction,
+    until it is no larger than ``coarse_size`` vertices, so odd cell counts
+    such as ``nx: 200`` (199 cells) coarsen too, on grids that are then
+    not nested. The operator is rediscretized on each grid and the
+    coarsest one is solved with splu. Prolongation is (bi/tri)linear
+    interpolation between the uniform grids and restriction its transpose.
+    A coarse vertex is Dirichlet when any fine vertex it interpolates to
+    is, so short sinks are still seen on coarse grids. The V- or F-cycle is
+    used as the preconditioner of a flexible conjugate gradient that stops
+    at ``rtol`` relative residual. Each iteration's time is kept in
+    ``cycle_times``.
+
+    Args:
+        length (float): 板边长
+        bds (list): Dirichlet 边界
+        u_D (float): 边界默认温度
+        Nx, Ny, Nz (int): 各方向单元数, Nz 为 None 时为 2d
+        rtol (float): 相对残差
+        atol (float): 绝对残差
+        max_iter (int): 最大迭代次数
+        cycle (str): V or F
+        smoothing (int): 每层前后光滑次数
+        coarse_size (int): 最粗网格每个方向的顶点数上限
+    """
+
+    def __init__(
+        self,
+        length,
+        bds,
+        u_D,
+        Nx,
+        Ny,
+        Nz=None,
+        rtol=1e-10,
+        atol=0.0,
+        max_iter=100,
+        cycle="V",
+        smoothing=2,
+        coarse_size=33,
+    ):
+        if not bds:
+            raise ValueError('Boundary conditions empty!')
+        if cycle not in ["V", "F"]:
+            raise LookupError(f"Cycle {cycle} is not supported (V, F)!")
+        self.length = length
+        self.shape = (Ny + 1, Nx + 1) if Nz is None else (Nz + 1, Ny + 1, Nx + 1)
+        self.coordinates = grid_coordinates(length, self.shape)
+        _, volume = laplacian(self.shape, length)
+        self.volume = volume.reshape(self.shape)
+        values = dirichlet_values(bds, u_D, self.coordinates, length).reshape(self.shape)
+        fixed = ~np.isnan(values)
+        self.u_fixed = np.where(fixed, values, 0.0)
+        self.rtol = rtol
+        self.atol = atol
+        self.max_iter = max_iter
+        self.cycle = cycle
+        self.smoothing = smoothing
+
+        self.levels = [GridLevel(self.shape, length, fixed)]
+        while max(self.levels[-1].shape) > max(coarse_size, 3):
+            level = self.levels[-1]
+            # ceil(cells / 2) 个单元
+            shape = tuple(n // 2 + 1 for n in level.shape)
+            # 第 l 层存储由第 l + 1 层插值到第 l 层的矩阵
+            level.interpolation = [interpolation(n_f, n_c) for n_f, n_c in zip(level.shape, shape)]
+            self.levels.append(GridLevel(shape, length, coarsen_mask(level.fixed, level.interpolation)))
+        coarse = self.levels[-1]
+        K, _ = laplacian(coarse.shape, length)
+        self.coarse_free = np.flatnonzero(coarse.free)
+        self.coarse_lu = splu(
+            K[self.coarse_free][:, self.coarse_free].tocsc(), permc_spec="MMD_AT_PLUS_A"
+        )
+        # Dirichlet 值对非边界顶点的贡献
+        self.b_fixed = self.levels[0].apply(self.u_fixed)
+        self.iterations = 0
+        self.residuals = []
+        self.cycle_times = []
+
+    def solve(self, F):
+        """Solve with heat source matrix F, returns vertex values (flat)."""
+        fine = self.levels[0]
+        f = self._source_values(F).reshape(self.shape)
+        r = (self.volume * f - self.b_fixed) * fine.free
+        x = np.zeros(self.shape)
+        tol = max(self.rtol * np.linalg.norm(r), self.atol)
+
+        self.residuals = [np.linalg.norm(r)]
+        self.cycle_times = []
+        z = self.precondition(0, r, self.cycle)
+        p = z.copy()
+        rz = np.vdot(r, z)
+        for _ in range(self.max_iter):
+            if self.residuals[-1] <= tol:
+                break
+            t0 = time.perf_counter()
+            Ap = fine.apply(p) * fine.free
+            alpha = rz / np.vdot(p, Ap)
+            x += alpha * p
+            r -= alpha * Ap
+            self.residuals.append(np.linalg.norm(r))
+            if self.residuals[-1] > tol:
+                # flexible CG: F-cycle 不是严格对称的预条件
+                z_new = self.precondition(0, r, self.cycle)
+                beta = np.vdot(r, z_new - z) / rz
+                rz = np.vdot(r, z_new)
+                p = z_new + beta * p
+                z = z_new
+            self.cycle_times.append(time.perf_counter() - t0)
+        else:
+            if self.residuals[-1] > tol:
+                raise RuntimeError(
+                    f"Multigrid did not converge in {self.max_iter} iterations "
+                    f"(residual {self.residuals[-1]:.3e} > {tol:.3e})!"
+                )
+        self.iterations = len(self.cycle_times)
+        return (x + self.u_fixed).ravel()
+
+    def precondition(self, l, r, cycle="V"):
+        """一次 V / F 循环, 近似求解第 l 层的误差方程"""
+        level = self.levels[l]
+        if l == len(self.levels) - 1:
+            e = np.zeros(level.shape)
+            e.flat[self.coarse_free] = self.coarse_lu.solve(r.ravel()[self.coarse_free])
+            return e
+
+        e = level.smooth(None, r, self.smoothing)
+        coarse = self.levels[l + 1]
+        r_c = restrict(r - level.apply(e), level.interpolation) * coarse.free
+        e_c = self.precondition(l + 1, r_c, cycle)
+        if cycle == "F":
+            e_c += self.precondition(l + 1, r_c - coarse.apply(e_c) * coarse.free, "V")
+        e += prolong(e_c, level.interpolation) * level.free
+        return level.smooth(e, r, self.smoothing)
+
+
+class GridLevel:
+    """多重网格中的一层: 矩阵无关的刚度矩阵作用与 Jacobi 光滑
+
+    Args:
+        shape (tuple): 顶点数组形状 ((z,) y, x)
+        length (float): 板边长
+        fixed (ndarray): Dirichlet 顶点
+    """
+
+    omega = 0.8  # 阻尼 Jacobi 权重
+
+    def __init__(self, shape, length, fixed):
+        self.shape = shape
+        self.fixed = fixed
+        self.interpolation = None
+        self.free = (~fixed).astype(np.float64)
+        ndim = len(shape)
+        volumes = []
+        for n in shape:
+            h = length / (n - 1)
+            v = np.full(n, h)
+            v[[0, -1]] = h / 2
+            volumes.append(v)
+        # 沿 axis 方向每条边的系数: 其他方向的控制体积 / h, 沿 axis 方向为 1 (广播)
+        self.weights = []
+        self.slices = []
+        diagonal = np.zeros(shape)
+        for axis, n in enumerate(shape):
+            h = length / (n - 1)
+            others = [volumes[k] if k != axis else np.ones(1) for k in range(ndim)]
+            weight = reduce(np.multiply.outer, others) / h
+            self.weights.append(weight)
+            lower = [slice(None)] * ndim
+            upper = [slice(None)] * ndim
+            lower[axis] = slice(None, -1)
+            upper[axis] = slice(1, None)
+            self.slices.append((tuple(lower), tuple(upper)))
+            diagonal[tuple(lower)] += weight
+            diagonal[tuple(upper)] += weight
+        self.inv_diagonal = self.omega * self.free / diagonal
+
+    def apply(self, u):
+        """K u, 两端为 Neumann (零通量)"""
+        out = np.zeros(self.shape)
+        for axis, (weight, (lower, upper)) in enumerate(zip(self.weights, self.slices)):
+            flux = np.diff(u, axis=axis)
+            flux *= weight
+            out[lower] -= flux
+            out[upper] += flux
+        return out
+
+    def smooth(self, e, r, sweeps):
+        """阻尼 Jacobi, e 为 None 时从零开始"""
+        for _ in range(sweeps):
+            if e is None:
+                e = self.inv_diagonal * r
+            else:
+                e = e + self.inv_diagonal * (r - self.apply(e))
+        return e
+
+
+def interpolation(n_fine, n_coarse):
+    """n_coarse 个均匀顶点到 n_fine 个均匀顶点的线性插值矩阵
+
+    With ``n_fine - 1 = 2 (n_coarse - 1)`` the grids are nested and the
+    columns are the usual (0.5, 1, 0.5) stencil.
+    """
+    t = np.arange(n_fine) * (n_coarse - 1) / (n_fine - 1)
+    j = np.minimum(np.floor(t).astype(np.int64), n_coarse - 2)
+    w = t - j
+    rows = np.arange(n_fine)
+    P = sp.csr_matrix(
+        (np.concatenate([1 - w, w]), (np.concatenate([rows, rows]), np.concatenate([j, j + 1]))),
+        shape=(n_fine, n_coarse),
+    )
+    P.eliminate_zeros()
+    return P
+
+
+def apply_axes(u, matrices):
+    """沿每个方向依次乘以一维矩阵"""
+    for axis, M in enumerate(matrices):
+        u = np.moveaxis(u, axis, 0)
+        shape = u.shape
+        u = (M @ u.reshape(shape[0], -1)).reshape((M.shape[0],) + shape[1:])
+        u = np.moveaxis(u, 0, axis)
+    return u
+
+
+def coarsen_mask(fixed, matrices):
+    """粗网格 Dirichlet 顶点: 插值到的细网格顶点中有 Dirichlet 即为 Dirichlet"""
+    return restrict(fixed.astype(np.float64), matrices) > 0
+
+
+def restrict(r, matrices):
+    """细网格残差到粗网格, 为 prolong 的转置"""
+    return apply_axes(r, [P.T for P in matrices])
+
+
+def prolong(e, matrices):
+    """粗网格修正线性插值到细网格"""
+    return apply_axes(e, matrices)
+
+
+def axis_eigenvalues(kind, n):
+    """一维 ghost node Laplacian (h = 1) 在对应变换下的特征值"""
+    if kind == "NN":
+        return 2 - 2 * np.cos(np.pi * np.arange(n) / (n - 1))
+    if kind == "DD":
+        return 2 - 2 * np.cos(np.pi * np.arange(1, n - 1) / (n - 1))
+    # 一端 Dirichlet 一端 Neumann
+    return 2 - 2 * np.cos(np.pi * (2 * np.arange(n - 1) + 1) / (2 * (n - 1)))
+
+
+def axis_transform(f, kind, axis, forward=True):
+    """沿 axis 的正变换 (顶点值 -> 模态系数) 或逆变换"""
+    if kind == "NN":
+        return dct(f, type=1, axis=axis) if forward else idct(f, type=1, axis=axis)
+    if kind == "DD":
+        return dst(f, type=1, axis=axis) if forward else idst(f, type=1, axis=axis)
+    if kind == "DN":
+        # 特征向量 sin(pi (2m + 1) j / (2N)), j = 1..N 由 DST-II 合成
+        return idst(f, type=2, axis=axis) if forward else dst(f, type=2, axis=axis)
+    # Neumann 端在前: 翻转顶点顺序后与 DN 相同, 模态系数不翻转
+    if forward:
+        return axis_transform(np.flip(f, axis=axis), "DN", axis, forward)
+    return np.flip(axis_transform(f, "DN", axis, forward), axis=axis)
+
+
+def grid_coordinates(length, shape):
+    """顶点坐标 (x, y(, z)), 顶点顺序与 fenics 一致"""
+    axes = [np.linspace(0.0, length, n) for n in shape]
+    grids = np.meshgrid(*axes, indexing="ij")
+    return np.stack([g.ravel() for g in grids[::-1]], axis=1)
+
+
+def laplacian(shape, length):
+    """均匀网格上的 -Laplace 刚度矩阵与各顶点控制体积
+
+    Along each axis the 1d stiffness is ``tridiag(-1, 2, -1) / h`` with 1
+    on the two end rows (Neumann) and the 1d control volume is ``h`` with
+    ``h / 2`` at the ends; the d-dimensional operator is the Kronecker sum.
+    """
+    stiffness, volume = [], []
+    for n in shape:
+        h = length / (n - 1)
+        e = np.ones(n)
+        main = 2 * e
+        main[[0, -1]] = 1
+        stiffness.append(sp.diags([-e[1:], main, -e[1:]], [-1, 0, 1]) / h)
+        v = h * e
+        v[[0, -1]] = h / 2
+        volume.append(v)
+
+    K = None
+    for axis in range(len(shape)):
+        factors = [
+            stiffness[k] if k == axis else sp.diags(volume[k]) for k in range(len(shape))
+        ]
+        term = reduce(lambda a, b: sp.kron(a, b, format="csr"), factors)
+        K = term if K is None else K + term
+    return K.tocsr(), reduce(np.multiply.outer, volume).ravel()
+
+
+def dirichlet_values(bds, u_D, coordinates, length):
+    """Dirichlet 边界取值, 非边界顶点为 nan
+
+    Follows ``boundary.AllBoundary``: a vertex on the domain boundary is
+    constrained by every segment whose bounding box (with TOL) contains it,
+    later boundaries overriding earlier ones.
+    """
+    values = np.full(coordinates.shape[0], np.nan)
+    x, y = coordinates[:, 0], coordinates[:, 1]
+    on_boundary = np.any((coordinates < TOL) | (coordinates > length - TOL), axis=1)
+    for bd in bds:
+        assert (len(bd) == 2 or len(bd) == 3 or len(bd) == 4), 'Error Boundary!'
+        (lx, ly), (rx, ry) = bd[1]
+        inside = on_boundary & (lx - TOL <= x) & (x <= rx + TOL) & (ly - TOL <= y) & (y <= ry + TOL)
+        if bd[0] == 'sink':
+            values[inside] = u_D if len(bd) == 2 else bd[2]
+        elif bd[0] == 'sine-wave':
+            u0 = u_D if len(bd) == 3 else bd[2]
+            um = bd[2] if len(bd) == 3 else bd[3]
+            interval = np.array(bd[1])
+            extent = abs(interval[1] - interval[0])
+            assert (extent[0] < TOL or extent[1] < TOL), 'Sine boundary is not on boundary!'
+            if extent[1] < TOL:
+                t, t0 = x, interval[0, 0]
+            else:
+                t, t0 = y, interval[0, 1]
+            values[inside] = um * np.sin((t[inside] - t0) * np.pi / max(extent)) + u0
+        else:
+            raise LookupError(f'Boundary condition {bd[0]} is not supported (sink, sine-wave)!')
+    if np.isnan(values).all():
+        raise ValueError('No vertex on the Dirichlet boundaries!')
+    return values
+
+
+def get_mesh_grid(length, nx, ny, nz=None):
+    """与 solver.get_mesh_grid 相同的坐标数组"""
+    shape = (ny + 1, nx + 1) if nz is None else (nz + 1, ny + 1, nx + 1)
+    coordinates = grid_coordinates(length, shape)
+    if nz is None:
+        xs = coordinates[:, 0].reshape(ny + 1, nx + 1).T
+        ys = coordinates[:, 1].reshape(ny + 1, nx + 1).T
+        return xs, ys, None
+    xs = coordinates[:, 0].reshape(nx + 1, ny + 1, nz + 1)
+    ys = coordinates[:, 1].reshape(nx + 1, ny + 1, nz + 1)
+    zs = coordinates[:, 2].reshape(nx + 1, ny + 1, nz + 1)
+    return xs, ys, zs
+
+
+# 每个进程各自缓存的求解器
+_solvers = {}
+
+
+def get_solver(length, bds, u_D, Nx, Ny, Nz=None, method="fd", **params):
+    """Return the cached solver of the current process.
+
+    ``method`` is fd (FDSolver), spectral (SpectralSolver) or multigrid
+    (MultigridSolver, ``params`` are its tolerances and cycle).
+    """
+    key = (length, repr(bds), u_D, Nx, Ny, Nz, method, tuple(sorted(params.items())))
+    if key not in _solvers:
+        if method == "fd":
+            _solvers[key] = FDSolver(length, bds, u_D, Nx, Ny, Nz)
+        elif method == "spectral":
+            _solvers[key] = SpectralSolver(length, bds, u_D, Nx, Ny, Nz)
+        elif method == "multigrid":
+            _solvers[key] = MultigridSolver(length, bds, u_D, Nx, Ny, Nz, **params)
+        else:
+            raise LookupError(f"Method {method} is not supported!")
+    return _solvers[key]
+
+
+def run_solver(ndim, length, units, bcs, u0, nx, F, coordinates=False, method="fd", **params):
+    """与 solver.run_solver 相同的接口与输出"""
+    ny = nx
+    nz = nx if ndim == 3 else None
+
+    u = get_solver(length, bcs, u0, nx, ny, nz, method=method, **params).solve(F)
+    if ndim == 2:
+        U = u.reshape(nx + 1, nx + 1)
+    else:
+        U = u.reshape(nx + 1, nx + 1, nx + 1)
+
+    if coordinates:
+        xs, ys, zs = get_mesh_grid(length, nx, ny, nz)
+    else:
+        xs, ys, zs = None, None, None
+    return U, xs, ys, zs
@@ -0,0 +1,72 @@
+# -*- encoding: utf-8 -*-
+"""
+Desc      :   Streaming Python API that yields samples without writing files.
+"""
+# File    :   stream.py
+
+from collections import deque
+from multiprocessing import Pool
+
+from src.config.configarg import load_options
+from src.generator.generator import (
+    get_state,
+    sample_range,
+    index_chunks,
+    pool_init,
+    generate_batch,
+)
+
+
+def stream(config=None, batch_size=16, start=None, stop=None, workers=0, prefetch=2, **overrides):
+    """按样本序号顺序逐批生成样本, 不写文件
+
+    The layout, the monitoring points and the solver (or superposition
+    basis) are built once, then every batch is solved in this process or,
+    with ``workers > 0``, in a pool that keeps ``prefetch`` batches per
+    worker in flight. Sample ``i`` is identical to sample ``i`` of
+    ``recon_data_generator generate`` with the same options and seed.
+
+    Example:
+        for batch in stream({"nx": 101, "method": "fd", "seed": 1}, batch_size=32, stop=1024):
+            train_step(batch["u_obs"], batch["u"])
+
+    Args:
+        config (str or dict): 配置文件路径或参数字典, 见 configarg.load_options
+        batch_size (int): 每批样本数
+        start (int): 第一个样本序号 (默认 options.start)
+        stop (int): 样本序号上界 (默认 options.stop 或 sample_n)
+        workers (int): 后台工作进程数, 0 表示在当前进程中求解
+        prefetch (int): 每个工作进程预取的批数
+
+    Yields:
+        dict: index, u, F, u_obs 按样本堆叠 (首维为样本), 以及 xs, ys, zs, u_pos
+    """
+    options = load_options(config, **overrides)
+    if start is not None:
+        options.start = start
+    if stop is not None:
+        options.stop = stop
+    start, stop = sample_range(options)
+    state = get_state(options)
+    batches = index_chunks(range(start, stop), batch_size)
+
+    if workers <= 0:
+        pool_init(state)
+        for indices in batches:
+            yield generate_batch(indices)
+        return
+
+    with Pool(workers, initializer=pool_init, initargs=(state, None)) as pool:
+        pending = deque()
+        batches = iter(batches)
+        # 只提交有限个批次, 消费者较慢时内存不会增长
+        for indices in batches:
+            pending.append(pool.apply_async(generate_batch, (indices,)))
+            if len(pending) >= workers * max(1, prefetch):
+                break
+        while pending:
+            batch = pending.popleft().get()
+            indices = next(batches, None)
+            if indices is not None:
+                pending.append(pool.apply_async(generate_batch, (indices,)))
+            yield batch
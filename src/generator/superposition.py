@@ -0,0 +1,85 @@
+# -*- encoding: utf-8 -*-
+"""
+Desc      :   Superposition of unit-power temperature fields.
+"""
+# File    :   superposition.py
+
+from functools import partial
+from multiprocessing import Pool
+import numpy as np
+
+from src.data.base import Components
+from src.generator.sampling import FMatrix
+
+
+class SuperpositionBasis:
+    """线性叠加基: 边界场 + 各组件单位功率温度场
+
+    The steady heat equation is linear in the source and both the uniform
+    and gaussian footprints scale linearly with the intensity, so with a
+    fixed layout and fixed boundary conditions
+
+        U = U_bc + sum_i weights[i] * (U(F_i) - U_bc)
+
+    where ``U_bc`` is the field without heat sources and ``F_i`` is the
+    unit-intensity footprint of component ``i``.
+
+    Args:
+        components (Components): 组件信息
+        F (ndarray): 单位功率热源矩阵, shape (number, grid, grid)
+        U_bc (ndarray): 无热源时的温度场
+        U (ndarray): 单位功率温度场 (已减去 U_bc), shape (number, grid, grid)
+    """
+
+    def __init__(self, components: Components, F, U_bc, U, xs=None, ys=None, zs=None):
+        self.components = components
+        self.F = F
+        self.U_bc = U_bc
+        self.U = U
+        self.xs = xs
+        self.ys = ys
+        self.zs = zs
+        # 展平后直接做矩阵向量乘 (BLAS gemv)
+        self._U_flat = U.reshape(U.shape[0], -1).T
+        self._F_flat = F.reshape(F.shape[0], -1).T
+
+    def field(self, weights):
+        """由组件有效功率构造温度场"""
+        U = self.U_bc.ravel() + self._U_flat @ np.asarray(weights, dtype=np.float64)
+        return U.reshape(self.U_bc.shape)
+
+    def source(self, weights):
+        """由组件有效功率构造热源矩阵"""
+        F = self._F_flat @ np.asarray(weights, dtype=np.float64)
+        return F.reshape(self.F.shape[1:])
+
+    @classmethod
+    def from_options(cls, options, components: Components, worker=None):
+        """对每个组件求解一次单位功率场，共 number + 1 次求解"""
+        F = unit_sources(components)
+        sources = [np.zeros_like(F[0])] + list(F)
+        # 自适应网格由全部组件的覆盖区域确定, 各单位场共用一个网格
+        solve_p = partial(solve_unit_field, options=options, footprint=unit_footprint(components))
+        with Pool(worker) as pool:
+            fields = pool.map(solve_p, sources)
+        U_bc, xs, ys, zs = fields[0]
+        U = np.stack([u - U_bc for u, _, _, _ in fields[1:]])
+        return cls(components, F, U_bc, U, xs=xs, ys=ys, zs=zs)
+
+
+def unit_sources(components: Components):
+    """各组件单位功率对应的热源矩阵"""
+    F, _ = FMatrix(components, None).unit2matrix()
+    return F
+
+
+def unit_footprint(components: Components):
+    """所有组件覆盖的网格"""
+    _, overlap = FMatrix(components, None).unit2matrix()
+    return np.asarray(overlap).any(axis=0)
+
+
+def solve_unit_field(F, options, footprint=None):
+    from src.generator.generator import solve_field
+
+    return solve_field(F, options, footprint=footprint)
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+fs = pytest.importorskip("fenics")
+
+from src.generator.boundary import AllBoundary
+from src.generator.solver import PoissonSolver, Source, get_mesh
+
+
+LENGTH = 0.1
+U_D = 298.0
+BCS = [["sink", [[0.04, 0], [0.06, 0]]], ["sine-wave", [[0, 0.1], [0.1, 0.1]], 15]]
+
+
+@pytest.mark.parametrize("n", [21, 41])
+def test_grid_source_matches_expression(n):
+    nx = 20
+    F = np.random.default_rng(0).random((n, n)) * 1e4
+    solver = PoissonSolver(LENGTH, BCS, U_D, nx, nx)
+    solver.solve(F)
+
+    # 原有的组装方式: Source 表达式作为热源, 每次重新组装求解
+    V = fs.FunctionSpace(get_mesh(LENGTH, nx, nx), "P", 1)
+    bcs = AllBoundary(V, BCS, U_D).get_boundary()
+    u, v = fs.TrialFunction(V), fs.TestFunction(V)
+    expected = fs.Function(V)
+    fs.solve(fs.dot(fs.grad(u), fs.grad(v)) * fs.dx == Source(F, LENGTH) * v * fs.dx, expected, bcs)
+
+    np.testing.assert_allclose(solver.vertex_values(), expected.compute_vertex_values(), rtol=1e-10)
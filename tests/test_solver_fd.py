@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from src.config.configarg import load_options
+from src.generator.benchmark import get_sources
+from src.generator import solver_fd
+
+
+LENGTH = 0.1
+U_D = 298.0
+LEFT = [["sink", [[0, 0], [0, LENGTH]]]]
+PARTIAL = [["sink", [[0.04, 0], [0.06, 0]]], ["sink", [[0, 0.05], [0, 0.06]]]]
+
+
+@pytest.fixture(scope="module")
+def options():
+    return load_options("config/test_config.yml")
+
+
+@pytest.fixture(scope="module")
+def sources(options):
+    return get_sources(options, 2)
+
+
+def quadratic(x, f):
+    """-u'' = f, u(0) = U_D, u'(LENGTH) = 0 的解析解"""
+    return U_D + f * (LENGTH * x - x ** 2 / 2)
+
+
+@pytest.mark.parametrize("method", ["fd", "spectral", "multigrid"])
+@pytest.mark.parametrize("nx", [16, 25])
+def test_closed_form(method, nx):
+    # 二次解在内部与半控制体积的 Neumann 边界上均精确满足离散方程
+    f = 2e4
+    F = np.full((nx + 1, nx + 1), f)
+    solver = solver_fd.get_solver(LENGTH, LEFT, U_D, nx, nx, method=method, rtol=1e-12)
+    u = solver.solve(F)
+    x = solver.coordinates[:, 0]
+    np.testing.assert_allclose(u, quadratic(x, f), rtol=0, atol=1e-8)
+
+
+@pytest.mark.parametrize("method", ["fd", "spectral", "multigrid"])
+def test_closed_form_3d(method):
+    nx = 8
+    f = 2e4
+    F = np.full((nx + 1,) * 3, f)
+    solver = solver_fd.get_solver(LENGTH, LEFT, U_D, nx, nx, nx, method=method, rtol=1e-12)
+    u = solver.solve(F)
+    x = solver.coordinates[:, 0]
+    np.testing.assert_allclose(u, quadratic(x, f), rtol=0, atol=1e-8)
+
+
+@pytest.mark.parametrize("bcs", ["config", PARTIAL], ids=["config", "partial"])
+@pytest.mark.parametrize("method", ["spectral", "multigrid"])
+def test_agrees_with_fd(options, sources, bcs, method):
+    bcs = options.bcs if bcs == "config" else bcs
+    nx = options.nx
+    fd = solver_fd.FDSolver(options.length, bcs, options.u_D, nx, nx)
+    solver = solver_fd.get_solver(options.length, bcs, options.u_D, nx, nx, method=method, rtol=1e-12)
+    for F in sources:
+        u_fd = fd.solve(F)
+        rise = u_fd.max() - options.u_D
+        np.testing.assert_allclose(solver.solve(F), u_fd, rtol=0, atol=1e-9 * rise)
+
+
+@pytest.mark.parametrize("nx", [199, 200, 1023])
+def test_multigrid_levels(nx):
+    # 奇数单元数同样需要逐层粗化
+    solver = solver_fd.MultigridSolver(LENGTH, LEFT, U_D, nx, nx)
+    shapes = [level.shape for level in solver.levels]
+    assert len(shapes) > 1
+    assert max(shapes[-1]) <= 33
+    assert all(a[0] > b[0] for a, b in zip(shapes, shapes[1:]))
+
+
+@pytest.mark.parametrize("n_fine, n_coarse", [(9, 5), (10, 6), (200, 101)])
+def test_interpolation(n_fine, n_coarse):
+    P = solver_fd.interpolation(n_fine, n_coarse)
+    # 线性插值保持常数与线性函数
+    np.testing.assert_allclose(P @ np.ones(n_coarse), 1)
+    np.testing.assert_allclose(P @ np.linspace(0, 1, n_coarse), np.linspace(0, 1, n_fine))
+
+
+def test_fenics_lu(options, sources):
+    pytest.importorskip("fenics")
+    from src.generator import solver
+
+    nx = options.nx
+    for F in sources:
+        U, _, _, _ = solver.run_solver(
+            2, options.length, options.units, options.bcs, options.u_D, nx, F, linear_solver="lu"
+        )
+        U_fd, _, _, _ = solver_fd.run_solver(
+            2, options.length, options.units, options.bcs, options.u_D, nx, F, method="fd"
+        )
+        # 两者仅热源的积分方式不同
+        rise = U.max() - options.u_D
+        assert np.abs(U_fd - U).max() < 0.05 * rise
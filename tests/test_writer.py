@@ -0,0 +1,66 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from src.config.configarg import load_options
+from src.data import data_processing
+from src.data.data_processing import is_valid_mat
+
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+@pytest.mark.skipif(os.name != "posix", reason="sends SIGINT to the process group")
+def test_interrupt_flushes_written_samples(tmp_path):
+    data_dir = tmp_path / "data"
+    args = [
+        sys.executable, "-c", "from src.cli import main; main()", "generate",
+        "--config", str(ROOT / "src/config/default_c_power.yml"),
+        "--method", "fd", "--seed", "7", "--sample_n", "3000", "--worker", "4",
+        "--data_dir", str(data_dir),
+    ]
+    with open(tmp_path / "log", "w") as log:
+        # 与终端中的 Ctrl-C 一样, SIGINT 发给整个进程组
+        process = subprocess.Popen(args, cwd=ROOT, stdout=log, stderr=log, start_new_session=True)
+        try:
+            journal = data_dir / "Example.journal"
+            deadline = time.time() + 120
+            while not (journal.exists() and journal.stat().st_size > 0):
+                assert process.poll() is None and time.time() < deadline, "run did not start writing"
+                time.sleep(0.2)
+            time.sleep(1)
+            os.killpg(process.pid, signal.SIGINT)
+            process.wait(30)
+        finally:
+            if process.poll() is None:
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+
+    assert process.returncode != 0
+    written = {int(line.split()[1]) for line in journal.read_text().splitlines()}
+    files = {int(path.stem[len("Example"):]) for path in data_dir.glob("Example*.mat")}
+    assert 0 < len(written) < 3000
+    assert written == files
+    assert all(is_valid_mat(data_dir / f"Example{i}.mat") for i in written)
+    assert not list(data_dir.glob("*.tmp"))
+
+
+def test_shards_resume_needs_journal(tmp_path):
+    options = load_options(
+        "config/test_config.yml", data_dir=str(tmp_path), file_format="npy-shards",
+        shard_size=4, sample_n=8, seed=3, dtype="float64",
+    )
+    grid = np.zeros((5, 5))
+    samples = [(i, grid + 298.0 + i, grid + i, grid) for i in [0, 1, 5]]
+    data_processing.save_batch(options, samples, grid, grid, grid)
+    assert data_processing.completed_indices(options, range(8)) == {0, 1, 5}
+
+    # 没有日志时, 稀疏分片中未写的行 (全 0) 无法与已写的行区分
+    data_processing.journal_path(options).unlink()
+    assert data_processing.completed_indices(options, range(8)) == set()